@@ -0,0 +1,375 @@
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from io import BytesIO
+
+# index.py refuses to import without these; the benchmarks never touch OAuth.
+os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+os.environ.setdefault('GOOGLE_CREDENTIALS_FILENAME', 'credentials.json')
+
+import index
+
+
+def time_call(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+SYNTHETIC_COURSES = [
+    ('CSE', '110', 'Principles of Programming'),
+    ('CSE', '205', 'Object-Oriented Programming and Data Structures'),
+    ('MAT', '265', 'Calculus for Engineers I'),
+    ('ENG', '101', 'First-Year Composition'),
+    ('PHY', '121', 'University Physics I: Mechanics'),
+    ('CHM', '113', 'General Chemistry I'),
+]
+SYNTHETIC_INSTRUCTORS = ['Smith, John', 'Nguyen, Linh', 'Garcia, Maria; Lee, Sam', 'Staff']
+SYNTHETIC_DAYS = ['MW', 'Tu Th', 'MWF', 'M', 'F']
+# RRULE day codes for each SYNTHETIC_DAYS cell, written out independently of index.DAY_MAPPING.
+SYNTHETIC_DAY_CODES = {'MW': ('MO', 'WE'), 'Tu Th': ('TU', 'TH'), 'MWF': ('MO', 'WE', 'FR'), 'M': ('MO',), 'F': ('FR',)}
+SYNTHETIC_TIMES = ['9:00 AM - 9:50 AM', '10:30AM - 11:45AM', '1:30 PM - 2:45 PM', '4:30 PM - 5:45 PM']
+SYNTHETIC_LOCATIONS = ['Tempe - COOR 170', 'Tempe - BYENG 210', 'Tempe - PSH 150']
+
+
+SYNTHETIC_HEADER = ['Class', 'Course', 'Title', 'Units', 'Instructor(s)', 'Days', 'Start/End', 'Dates', 'Location']
+SYNTHETIC_COLUMN_WIDTHS = [70, 80, 370, 50, 190, 60, 170, 140, 170]
+
+
+def synthetic_section(rng):
+    """One schedule row as its table cells."""
+    subject, number, title = rng.choice(SYNTHETIC_COURSES)
+    return [str(rng.randint(10000, 999999)), f"{subject} {number}", title, rng.choice(['3.00', '4.00', '1.00']),
+            rng.choice(SYNTHETIC_INSTRUCTORS), rng.choice(SYNTHETIC_DAYS), rng.choice(SYNTHETIC_TIMES),
+            '8/22/24 - 12/6/24', rng.choice(SYNTHETIC_LOCATIONS)]
+
+
+def generate_ocr_text(rng, sections):
+    """Text shaped like Tesseract output for an ASU schedule screenshot."""
+    lines = [' '.join(SYNTHETIC_HEADER)]
+    for _ in range(sections):
+        row = ' '.join(synthetic_section(rng))
+        words = row.split()
+        if rng.random() < 0.3:
+            # OCR often wraps long cells onto a second line.
+            cut = rng.randint(len(words) // 2, len(words) - 1)
+            lines.append(' '.join(words[:cut]))
+            lines.append(' '.join(words[cut:]))
+        else:
+            lines.append(row)
+    if rng.random() < 0.2:
+        lines.append('icourse: this class is an iCourse')
+    return '\n'.join(lines)
+
+
+def bench_parse(args):
+    rng = random.Random(args.seed)
+    corpus = [generate_ocr_text(rng, rng.randint(3, 8)) for _ in range(args.corpus)]
+    line_count = sum(len(text.splitlines()) for text in corpus)
+    # Per-event logging would dominate the measurement; this benchmark is about the parser.
+    logging.disable(logging.CRITICAL)
+    try:
+        timings, _ = time_call(lambda: [index.parse_schedule(text) for text in corpus], args.repeat)
+    finally:
+        logging.disable(logging.NOTSET)
+    events = sum(len(index.parse_schedule(text)) for text in corpus)
+    best = min(timings)
+    print(f"Corpus: {len(corpus)} documents, {line_count} lines, {events} events parsed")
+    print(f"Best of {args.repeat}: {best:.3f}s, {line_count / best:,.0f} lines/s, {len(corpus) / best:,.0f} documents/s")
+
+
+FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+    '/usr/share/fonts/truetype/freefont/FreeSans.ttf',
+    '/Library/Fonts/Arial.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf',
+]
+
+
+def available_fonts():
+    return [path for path in FONT_CANDIDATES if os.path.exists(path)] or [None]
+
+
+def load_font(path, size):
+    from PIL import ImageFont
+    if path is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(path, size)
+
+
+def generate_schedule_image(rng, sections, font_path, scale):
+    """Render a schedule screenshot. Returns (png_bytes, ground_truth_signatures)."""
+    from PIL import Image, ImageDraw
+    rows = [synthetic_section(rng) for _ in range(sections)]
+    font = load_font(font_path, int(14 * scale))
+    margin, banner, row_height = int(40 * scale), int(60 * scale), int(30 * scale)
+    widths = [int(width * scale) for width in SYNTHETIC_COLUMN_WIDTHS]
+    width = margin * 2 + sum(widths)
+    height = banner + margin * 2 + row_height * (sections + 1)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    # Page chrome that the table detection is expected to crop away.
+    draw.rectangle([0, 0, width, banner], fill=(140, 29, 64))
+    draw.text((margin, banner // 3), 'My Class Schedule', fill='white', font=font)
+    top = banner + margin
+    for row_index, cells in enumerate([SYNTHETIC_HEADER] + rows):
+        y = top + row_index * row_height
+        x = margin
+        for cell, column_width in zip(cells, widths):
+            draw.text((x + int(4 * scale), y + int(7 * scale)), cell, fill=(30, 30, 30), font=font)
+            x += column_width
+        draw.line([margin, y + row_height, width - margin, y + row_height], fill=(221, 221, 221), width=max(int(scale), 1))
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue(), {section_signature(cells) for cells in rows}
+
+
+def section_signature(cells):
+    """The expected event for a generated row, built from its cells without the parser."""
+    class_num, course, title, _, _, days, times, dates, _ = cells
+    start_time, end_time = (datetime.strptime(value.replace(' ', ''), '%I:%M%p').time() for value in times.split(' - '))
+    start_date, end_date = (datetime.strptime(value, '%m/%d/%y').date() for value in dates.split(' - '))
+    return (class_num, f"{course} - {title}", SYNTHETIC_DAY_CODES[days], start_time, end_time, start_date, end_date)
+
+
+def event_signature(event):
+    return (event.class_num, event.summary, tuple(event.days_of_week), event.start.time(), event.end.time(),
+            event.start.date(), event.end_date.date())
+
+
+class FakeCalendarService:
+    """Just enough of the Calendar client for add_events_to_calendar, with a
+    fixed simulated latency per HTTP round trip."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.round_trips = 0
+        self.inserted = 0
+
+    def events(self):
+        return self
+
+    def insert(self, calendarId, body):
+        return FakeCalendarRequest(self, body)
+
+    def new_batch_http_request(self, callback):
+        return FakeCalendarBatch(self, callback)
+
+    def round_trip(self):
+        self.round_trips += 1
+        time.sleep(self.latency)
+
+    def store(self, body):
+        self.inserted += 1
+        return dict(body, id=f"fake{self.inserted}")
+
+
+class FakeCalendarRequest:
+    def __init__(self, service, body):
+        self.service = service
+        self.body = body
+
+    def execute(self):
+        self.service.round_trip()
+        return self.service.store(self.body)
+
+
+class FakeCalendarBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.round_trip()
+        for request_id, request in self.requests:
+            self.callback(request_id, self.service.store(request.body), None)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def bench_e2e(args):
+    rng = random.Random(args.seed)
+    fonts = available_fonts()
+    corpus = []
+    for _ in range(args.images):
+        font = rng.choice(fonts)
+        scale = rng.choice(args.scales)
+        corpus.append((font, scale) + generate_schedule_image(rng, rng.randint(args.min_sections, args.max_sections), font, scale))
+    index.ocr_cache = index.OCRCache(0)
+    logging.disable(logging.INFO)
+    latencies, calendar_latencies = [], []
+    expected = matched = extra = 0
+    started = time.perf_counter()
+    try:
+        for font, scale, image_bytes, truth_signatures in corpus:
+            image_started = time.perf_counter()
+            events = index.extract_events_from_image(image_bytes)
+            latencies.append(time.perf_counter() - image_started)
+            found = {event_signature(event) for event in events}
+            expected += len(truth_signatures)
+            matched += len(truth_signatures & found)
+            extra += len(found - truth_signatures)
+            if events:
+                service = FakeCalendarService(args.calendar_latency / 1000)
+                calendar_started = time.perf_counter()
+                index.add_events_to_calendar(events, None, service=service)
+                calendar_latencies.append(time.perf_counter() - calendar_started)
+    finally:
+        logging.disable(logging.NOTSET)
+    elapsed = time.perf_counter() - started
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is KiB on Linux
+    print(f"Images: {len(corpus)} ({len(fonts)} font(s), scales {', '.join(str(s) for s in args.scales)})")
+    print(f"Throughput: {len(corpus) / elapsed:.2f} images/s")
+    print(f"OCR + parse latency: p50 {percentile(latencies, 0.5) * 1000:.0f}ms, p95 {percentile(latencies, 0.95) * 1000:.0f}ms")
+    if calendar_latencies:
+        print(f"Calendar insert latency ({args.calendar_latency:.0f}ms per round trip): "
+              f"p50 {percentile(calendar_latencies, 0.5) * 1000:.0f}ms, p95 {percentile(calendar_latencies, 0.95) * 1000:.0f}ms")
+    print(f"Peak RSS: {peak_rss_mb:.0f} MB")
+    print(f"Parse accuracy: {matched}/{expected} rows exact ({matched / max(expected, 1):.1%}), {extra} spurious")
+
+
+def bench_ocr(args):
+    # Disable the OCR cache so every run does the full pipeline.
+    index.ocr_cache = index.OCRCache(0)
+    print(f"{'Image':<40} {'Single (s)':>12} {'Rows (s)':>12} {'Speedup':>8} {'Events':>8}")
+    print("-" * 84)
+    for path in args.images:
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+        single, single_text = time_call(lambda: index.extract_text_from_image(image_bytes, row_parallel=False), args.repeat)
+        rows, rows_text = time_call(lambda: index.extract_text_from_image(image_bytes, row_parallel=True), args.repeat)
+        single_best = min(single)
+        rows_best = min(rows)
+        events = f"{len(index.parse_schedule(single_text))}/{len(index.parse_schedule(rows_text))}"
+        print(f"{os.path.basename(path):<40} {single_best:>12.3f} {rows_best:>12.3f} "
+              f"{single_best / rows_best:>7.2f}x {events:>8}")
+    print(f"Row workers: {index.OCR_ROW_WORKERS}, best of {args.repeat} run(s)")
+
+
+STARTUP_ROUTES = ['/', '/authorize', '/confirm']
+STARTUP_CLIENT_SECRETS = {
+    'web': {
+        'client_id': 'benchmark',
+        'client_secret': 'benchmark',
+        'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+        'token_uri': 'https://oauth2.googleapis.com/token',
+    }
+}
+FIRST_RESPONSE_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+response = index.app.test_client().get(sys.argv[1])
+finished = time.perf_counter()
+print(json.dumps({'status': response.status_code, 'import': imported - started, 'total': finished - started}))
+"""
+
+
+def startup_env():
+    env = dict(os.environ)
+    env.setdefault('FLASK_SECRET_KEY', 'benchmark')
+    env.setdefault('GOOGLE_CREDENTIALS_FILENAME', 'credentials.json')
+    env.setdefault('GOOGLE_CLIENT_SECRETS_JSON', json.dumps(STARTUP_CLIENT_SECRETS))
+    return env
+
+
+def parse_importtime(stderr):
+    """Top-level (cumulative_us, module) pairs from `python -X importtime` output."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith('  '):
+            continue  # imported by another module; already counted in its parent
+        modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)
+
+
+def bench_startup(args):
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    env = startup_env()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import index'],
+                            cwd=cwd, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr)
+        sys.exit(result.returncode)
+    modules = parse_importtime(result.stderr)
+    print(f"{'Top-level import':<40} {'Cumulative (ms)':>16}")
+    print("-" * 57)
+    for cumulative, name in modules[:args.top]:
+        print(f"{name:<40} {cumulative / 1000:>16.1f}")
+    print(f"{'Total':<40} {sum(cumulative for cumulative, _ in modules) / 1000:>16.1f}")
+    print()
+    print(f"{'Route':<20} {'Status':>6} {'Import (ms)':>12} {'First response (ms)':>20}")
+    print("-" * 61)
+    for route in args.routes:
+        runs = []
+        for _ in range(args.repeat):
+            output = subprocess.run([sys.executable, '-c', FIRST_RESPONSE_SCRIPT, route],
+                                    cwd=cwd, env=env, capture_output=True, text=True, check=True)
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        import_ms = statistics.median(run['import'] for run in runs) * 1000
+        total_ms = statistics.median(run['total'] for run in runs) * 1000
+        print(f"{route:<20} {runs[-1]['status']:>6} {import_ms:>12.1f} {total_ms:>20.1f}")
+    print(f"Median of {args.repeat} fresh interpreter(s) per route")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the schedule OCR pipeline.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ocr_parser = subparsers.add_parser('ocr', help='Compare single-call and row-parallel OCR.')
+    ocr_parser.add_argument('images', nargs='+', help='Schedule screenshots to OCR.')
+    ocr_parser.add_argument('--repeat', type=int, default=3, help='Runs per mode (best is reported).')
+    ocr_parser.set_defaults(func=bench_ocr)
+
+    parse_parser = subparsers.add_parser('parse', help='Parse throughput over synthetic OCR output.')
+    parse_parser.add_argument('--corpus', type=int, default=2000, help='Number of synthetic OCR documents.')
+    parse_parser.add_argument('--seed', type=int, default=0)
+    parse_parser.add_argument('--repeat', type=int, default=5, help='Runs over the corpus (best is reported).')
+    parse_parser.set_defaults(func=bench_parse)
+
+    e2e_parser = subparsers.add_parser('e2e', help='OCR -> parse -> calendar over synthetic screenshots.')
+    e2e_parser.add_argument('--images', type=int, default=20, help='Number of synthetic screenshots.')
+    e2e_parser.add_argument('--min-sections', type=int, default=3)
+    e2e_parser.add_argument('--max-sections', type=int, default=8)
+    e2e_parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 1.5, 2.0],
+                            help='Render scales; 2.0 approximates a retina screenshot.')
+    e2e_parser.add_argument('--calendar-latency', type=float, default=50, help='Simulated ms per Calendar round trip.')
+    e2e_parser.add_argument('--seed', type=int, default=0)
+    e2e_parser.set_defaults(func=bench_e2e)
+
+    startup_parser = subparsers.add_parser('startup', help='Import-time breakdown and cold time-to-first-response.')
+    startup_parser.add_argument('--routes', nargs='+', default=STARTUP_ROUTES, help='GET routes to time.')
+    startup_parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per route (median is reported).')
+    startup_parser.add_argument('--top', type=int, default=15, help='Number of top-level imports to list.')
+    startup_parser.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,125 @@
 import os
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
-from flask import Flask, request, redirect, url_for, render_template, session, flash
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-import pytesseract
-from PIL import Image
+from flask import Flask, request, redirect, url_for, render_template, session, flash, jsonify, make_response, g, has_request_context, Response, stream_with_context
+import click
 import os
 import datetime
-from datetime import datetime, timedelta, time
+from datetime import datetime, timedelta, time, timezone
 import re
-import cv2
-import numpy as np
-import pytz
 import logging
 import uuid
-from pytz import timezone
-import requests
-from io import BytesIO
 import base64
 import json
-from oauthlib.oauth2.rfc6749.errors import MissingCodeError
 from dotenv import load_dotenv
 import random
 import string
+import time as time_module
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from bisect import bisect_right
+from functools import lru_cache, wraps
+from dataclasses import dataclass, field, fields
+from contextlib import contextmanager
+import sqlite3
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from io import BytesIO
+import zipfile
+
+# cv2, numpy, pytesseract, pytz, requests and the Google client libraries are
+# imported inside the functions that use them. This is a serverless function,
+# and most requests (GET /, /authorize, /confirm) never touch OCR, so loading
+# them at import time only made every cold start slower.
 
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 load_dotenv()
 
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Per-event detail logs (every parsed row, every calendar body) are costly in the
+# hot loops, so they are DEBUG unless LOG_EVENT_DETAILS is set.
+LOG_EVENT_DETAILS = os.getenv('LOG_EVENT_DETAILS', '').lower() in ('1', 'true', 'yes')
+EVENT_LOG_LEVEL = logging.INFO if LOG_EVENT_DETAILS else logging.DEBUG
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = g.get('request_id', '-') if has_request_context() else '-'
+        return True
+
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s')
+for handler in logging.getLogger().handlers:
+    handler.addFilter(RequestIdFilter())
+
+def event_logging_enabled():
+    return logging.getLogger().isEnabledFor(EVENT_LOG_LEVEL)
+
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus model."""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+_stage_histograms = {}
+_stage_histograms_lock = threading.Lock()
+
+def observe_stage(stage, seconds):
+    with _stage_histograms_lock:
+        histogram = _stage_histograms.get(stage)
+        if histogram is None:
+            histogram = _stage_histograms[stage] = Histogram()
+    histogram.observe(seconds)
+
+@contextmanager
+def timed_stage(stage):
+    started = time_module.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time_module.perf_counter() - started
+        observe_stage(stage, elapsed)
+        logging.debug(f"{stage} took {elapsed * 1000:.1f}ms")
+
+def instrumented(stage):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.before_request
+def assign_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_started = time_module.perf_counter()
+
+@app.after_request
+def record_request(response):
+    response.headers['X-Request-ID'] = g.request_id
+    if request.endpoint:
+        observe_stage(f"request:{request.endpoint}", time_module.perf_counter() - g.request_started)
+    return response
+
 app.secret_key = os.getenv('FLASK_SECRET_KEY')
 
 if not app.secret_key:
@@ -42,34 +130,666 @@ CLIENT_SECRETS_FILE = os.getenv('GOOGLE_CREDENTIALS_FILENAME')
 if not CLIENT_SECRETS_FILE:
     raise ValueError("No CLIENT_SECRETS_FILE found in the .env file")
 
-def get_calendar_service(credentials):
-    service = build('calendar', 'v3', credentials=credentials)
-    return service
+CALENDAR_SERVICE_CACHE_SIZE = int(os.getenv('CALENDAR_SERVICE_CACHE_SIZE', '64'))
+CALENDAR_HTTP_TIMEOUT = int(os.getenv('CALENDAR_HTTP_TIMEOUT', '30'))
+
+# credential key -> services not currently checked out by a request
+_calendar_services = OrderedDict()
+_calendar_services_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def get_calendar_discovery_document():
+    """The Calendar v3 discovery document bundled with googleapiclient, parsed once."""
+    from googleapiclient.discovery_cache import get_static_doc
+    document = get_static_doc('calendar', 'v3')
+    if document is None:
+        raise RuntimeError("googleapiclient does not ship a static discovery document for calendar v3")
+    return json.loads(document)
+
+def calendar_service_key(credentials):
+    material = f"{credentials.client_id}:{credentials.refresh_token}:{credentials.token}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+@instrumented('build_calendar_service')
+def build_calendar_service(credentials):
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build_from_document
+    http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=CALENDAR_HTTP_TIMEOUT))
+    return build_from_document(get_calendar_discovery_document(), http=http)
+
+@contextmanager
+def calendar_service(credentials):
+    """Check out a Calendar service for these credentials and return it when done.
+
+    Services are reused per credential so that the httplib2 connection pool
+    (and its TLS sessions) survives between confirm requests. httplib2.Http is
+    not thread-safe, so a service is only ever used by one request at a time;
+    concurrent requests with the same credentials each get their own."""
+    key = calendar_service_key(credentials)
+    with _calendar_services_lock:
+        idle = _calendar_services.get(key)
+        service = idle.pop() if idle else None
+    if service is None:
+        service = build_calendar_service(credentials)
+    try:
+        yield service
+    finally:
+        with _calendar_services_lock:
+            _calendar_services.setdefault(key, []).append(service)
+            _calendar_services.move_to_end(key)
+            while len(_calendar_services) > CALENDAR_SERVICE_CACHE_SIZE:
+                _calendar_services.popitem(last=False)
+
+THRESHOLD_VALUE = 150
+TESSERACT_CONFIG = r'--oem 3 --psm 6'
+OCR_MODE = os.getenv('OCR_MODE', 'text').lower()
+if OCR_MODE not in ('text', 'structured'):
+    raise ValueError("OCR_MODE must be text or structured")
+OCR_THRESHOLD_MODE = os.getenv('OCR_THRESHOLD_MODE', 'fixed').lower()
+THRESHOLD_MODES = ('fixed', 'otsu', 'adaptive')
+ADAPTIVE_BLOCK_SIZE = 31
+ADAPTIVE_C = 15
+OCR_NORMALIZE = os.getenv('OCR_NORMALIZE', '1').lower() not in ('0', 'false', 'no')
+OCR_TARGET_TEXT_HEIGHT = int(os.getenv('OCR_TARGET_TEXT_HEIGHT', '28'))
+OCR_MIN_SCALE = 0.25
+# Only shrinks by default: upscaling ordinary screenshots made OCR slower
+# without reading more rows. Set above 1.0 to enlarge small text as well.
+OCR_MAX_SCALE = float(os.getenv('OCR_MAX_SCALE', '1.0'))
+OCR_SCALE_TOLERANCE = 0.1
+TEXT_HEIGHT_SAMPLE_WIDTH = 1600
+TEXT_HEIGHT_MIN_COMPONENTS = 10
+if OCR_MAX_SCALE < OCR_MIN_SCALE:
+    raise ValueError(f"OCR_MAX_SCALE must be at least {OCR_MIN_SCALE}")
+if OCR_THRESHOLD_MODE not in THRESHOLD_MODES:
+    raise ValueError(f"OCR_THRESHOLD_MODE must be one of {', '.join(THRESHOLD_MODES)}")
+OCR_ROI_ENABLED = os.getenv('OCR_ROI', '1').lower() not in ('0', 'false', 'no')
+ROI_GRID_LINE_THRESHOLD = 235
+ROI_MAX_LINE_THICKNESS = 6
+ROI_MAX_BLOCK_FILL = 0.6
+ROI_MIN_WIDTH_FRACTION = 0.3
+ROI_MAX_AREA_FRACTION = 0.95
+ROI_PADDING = 10
+OCR_DENOISE = os.getenv('OCR_DENOISE', 'none').lower()
+DENOISE_METHODS = ('none', 'open', 'median')
+OCR_DENOISE_METHOD = OCR_DENOISE.partition(':')[0]
+OCR_DENOISE_SIZE = int(OCR_DENOISE.partition(':')[2] or '3')
+if OCR_DENOISE_METHOD not in DENOISE_METHODS:
+    raise ValueError("OCR_DENOISE must be none, open:N or median:N")
+if OCR_DENOISE_METHOD == 'open' and OCR_DENOISE_SIZE < 2:
+    raise ValueError("OCR_DENOISE open size must be at least 2")
+if OCR_DENOISE_METHOD == 'median' and (OCR_DENOISE_SIZE < 3 or OCR_DENOISE_SIZE % 2 == 0):
+    raise ValueError("OCR_DENOISE median size must be an odd number of at least 3")
+OCR_ROW_PARALLEL = os.getenv('OCR_ROW_PARALLEL', '').lower() in ('1', 'true', 'yes')
+OCR_ROW_WORKERS = int(os.getenv('OCR_ROW_WORKERS', str(os.cpu_count() or 1)))
+ROW_TESSERACT_CONFIG = r'--oem 3 --psm 7'
+ROW_MIN_GAP = 2
+ROW_MIN_HEIGHT = 4
+ROW_PADDING = 3
+OCR_CACHE_SIZE = int(os.getenv('OCR_CACHE_SIZE', '128'))
+OCR_CACHE_DIR = os.getenv('OCR_CACHE_DIR')
+
+class OCRCache:
+    """Size-bounded LRU of OCR text keyed by image content and OCR settings,
+    with an optional on-disk tier shared across processes."""
+
+    def __init__(self, max_entries=128, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.cache_dir:
+            try:
+                with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                    text = f.read()
+            except OSError:
+                pass
+            else:
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                self._store(key, text)
+                return text
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, text):
+        self._store(key, text)
+        if self.cache_dir:
+            tmp_path = f"{self._disk_path(key)}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError as e:
+                logging.warning(f"Could not write OCR cache entry: {e}")
 
-def extract_text_from_image(image_path):
+    def _store(self, key, text):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'disk_hits': self.disk_hits,
+                    'entries': len(self._entries)}
+
+ocr_cache = OCRCache(OCR_CACHE_SIZE, OCR_CACHE_DIR)
+
+def ocr_settings_signature(output):
+    tesseract_config = ROW_TESSERACT_CONFIG if output == 'rows' else TESSERACT_CONFIG
+    normalize = f"{OCR_TARGET_TEXT_HEIGHT}:{OCR_MAX_SCALE:g}" if OCR_NORMALIZE else 'off'
+    denoise = f"{OCR_DENOISE_METHOD}:{OCR_DENOISE_SIZE}" if OCR_DENOISE_METHOD != 'none' else 'none'
+    return (f"threshold={OCR_THRESHOLD_MODE}:{THRESHOLD_VALUE};normalize={normalize};"
+            f"denoise={denoise};roi={OCR_ROI_ENABLED};"
+            f"output={output};tesseract={tesseract_config}")
+
+def ocr_cache_key(image_bytes, output='text'):
+    digest = hashlib.sha256(image_bytes)
+    digest.update(ocr_settings_signature(output).encode('utf-8'))
+    return digest.hexdigest()
+
+@lru_cache(maxsize=32)
+def structuring_kernel(width, height):
+    import cv2
+    return cv2.getStructuringElement(cv2.MORPH_RECT, (width, height))
+
+class PreprocessEngine:
+    """Runs the OpenCV preprocessing steps into per-thread scratch buffers, so a
+    worker handling a steady stream of screenshots stops allocating full-size
+    images for every one.
+
+    Each buffer is a flat array that only grows and is handed out as a contiguous
+    view of the requested shape. Arrays returned here stay valid until the same
+    thread preprocesses its next image."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def buffer(self, name, shape, dtype='uint8'):
+        import numpy as np
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        flat = buffers.get(name)
+        if flat is None or flat.dtype != dtype or flat.size < size:
+            flat = buffers[name] = np.empty(size, dtype=dtype)
+            logging.debug(f"Allocated {flat.nbytes} byte preprocessing buffer '{name}'")
+        return flat[:size].reshape(shape)
+
+    def grayscale(self, img):
+        import cv2
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=self.buffer('gray', img.shape[:2]))
+
+    def resize(self, src, scale, interpolation):
+        import cv2
+        height, width = src.shape[:2]
+        # cv2.resize derives the output size from fx/fy with the same rounding; an
+        # explicit dsize would make it recompute (and slightly change) the scale.
+        dst = self.buffer('resized', (int(round(height * scale)), int(round(width * scale))))
+        return cv2.resize(src, None, dst=dst, fx=scale, fy=scale, interpolation=interpolation)
+
+    def binarize(self, gray, mode):
+        import cv2
+        thresh = self.buffer('thresh', gray.shape[:2])
+        if mode == 'otsu':
+            _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU, dst=thresh)
+        elif mode == 'adaptive':
+            thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV,
+                                           ADAPTIVE_BLOCK_SIZE, ADAPTIVE_C, dst=thresh)
+        elif mode == 'fixed':
+            _, thresh = cv2.threshold(gray, THRESHOLD_VALUE, 255, cv2.THRESH_BINARY_INV, dst=thresh)
+        else:
+            raise ValueError(f"Unknown threshold mode: {mode} (expected one of {', '.join(THRESHOLD_MODES)})")
+        return thresh
+
+    def denoise(self, thresh):
+        """Remove speckle from the binary image according to OCR_DENOISE."""
+        import cv2
+        if OCR_DENOISE_METHOD == 'none':
+            return thresh
+        denoised = self.buffer('denoised', thresh.shape[:2])
+        if OCR_DENOISE_METHOD == 'open':
+            kernel = structuring_kernel(OCR_DENOISE_SIZE, OCR_DENOISE_SIZE)
+            return cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, dst=denoised)
+        return cv2.medianBlur(thresh, OCR_DENOISE_SIZE, dst=denoised)
+
+preprocess_engine = PreprocessEngine()
+
+def decode_image(image_bytes):
+    import cv2
+    import numpy as np
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+def estimate_text_height(gray):
+    """Median glyph height in pixels, measured on a downsampled copy for speed."""
+    import cv2
+    import numpy as np
+    height, width = gray.shape[:2]
+    factor = min(1.0, TEXT_HEIGHT_SAMPLE_WIDTH / width)
+    sample = gray
+    if factor < 1.0:
+        size = (int(width * factor), int(height * factor))
+        sample = cv2.resize(gray, size, dst=preprocess_engine.buffer('sample', (size[1], size[0])),
+                            interpolation=cv2.INTER_AREA)
+    _, binary = cv2.threshold(sample, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU,
+                              dst=preprocess_engine.buffer('sample_binary', sample.shape[:2]))
+    labels = preprocess_engine.buffer('sample_labels', sample.shape[:2], 'int32')
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, labels, connectivity=8)
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    # Keep glyph-sized components; drop specks, table lines and large blocks.
+    glyphs = (heights >= 3) & (heights < sample.shape[0] / 10) & (widths < sample.shape[1] / 10)
+    if np.count_nonzero(glyphs) < TEXT_HEIGHT_MIN_COMPONENTS:
+        return None
+    return float(np.median(heights[glyphs])) / factor
+
+def normalize_resolution(gray):
+    """Resize so text lands near OCR_TARGET_TEXT_HEIGHT. Returns (image, scale, text_height)."""
+    import cv2
+    text_height = estimate_text_height(gray)
+    if not text_height:
+        return gray, 1.0, None
+    scale = min(max(OCR_TARGET_TEXT_HEIGHT / text_height, OCR_MIN_SCALE), OCR_MAX_SCALE)
+    if abs(scale - 1.0) < OCR_SCALE_TOLERANCE:
+        return gray, 1.0, text_height
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+    resized = preprocess_engine.resize(gray, scale, interpolation)
+    return resized, scale, text_height
+
+def find_grid_region(gray):
+    import cv2
+    import numpy as np
+    height, width = gray.shape[:2]
+    # Row separators in the schedule table are light grey, so they only show up
+    # well below the text threshold; keep long horizontal runs only.
+    _, light = cv2.threshold(gray, ROI_GRID_LINE_THRESHOLD, 255, cv2.THRESH_BINARY_INV,
+                             dst=preprocess_engine.buffer('grid_light', gray.shape[:2]))
+    line_kernel = structuring_kernel(max(width // 3, 1), 1)
+    lines = cv2.morphologyEx(light, cv2.MORPH_OPEN, line_kernel,
+                             dst=preprocess_engine.buffer('grid_lines', gray.shape[:2]))
+    # Row and column maxima instead of lines.any()/findNonZero, which would build
+    # full-size temporaries.
+    line_rows = np.flatnonzero(cv2.reduce(lines, 1, cv2.REDUCE_MAX))
+    if line_rows.size == 0:
+        return None
+    breaks = np.flatnonzero(np.diff(line_rows) > 1)
+    run_starts = np.concatenate(([line_rows[0]], line_rows[breaks + 1]))
+    run_ends = np.concatenate((line_rows[breaks], [line_rows[-1]]))
+    # Solid bars (a page banner, a shaded header) survive the opening too; only
+    # thin runs are row separators.
+    thin = run_ends - run_starts + 1 <= ROI_MAX_LINE_THICKNESS
+    line_starts = run_starts[thin]
+    line_ends = run_ends[thin]
+    if line_starts.size < 2:
+        return None
+    row_height = int(np.median(np.diff(line_starts)))
+    line_columns = np.flatnonzero(cv2.reduce(lines[line_starts[0]:line_ends[-1] + 1], 0, cv2.REDUCE_MAX))
+    x, w = int(line_columns[0]), int(line_columns[-1] - line_columns[0] + 1)
+    top = max(int(line_starts[0]) - row_height, 0)
+    bottom = min(int(line_ends[-1]) + row_height, height)
+    return x, top, w, bottom - top
+
+def find_text_block_region(thresh):
+    import cv2
+    height, width = thresh.shape[:2]
+    block_kernel = structuring_kernel(max(width // 50, 3), max(height // 100, 3))
+    blocks = cv2.dilate(thresh, block_kernel, dst=preprocess_engine.buffer('text_blocks', thresh.shape[:2]))
+    contours, _ = cv2.findContours(blocks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+        x, y, w, h = cv2.boundingRect(contour)
+        # A solid bar binarizes to one filled block; text is mostly background.
+        if cv2.countNonZero(thresh[y:y + h, x:x + w]) > w * h * ROI_MAX_BLOCK_FILL:
+            continue
+        return x, y, w, h
+    return None
+
+def find_table_region(gray, thresh):
+    """Return the (x, y, w, h) box of the schedule table, or None to OCR the whole image."""
+    height, width = thresh.shape[:2]
+    for finder, source in ((find_grid_region, gray), (find_text_block_region, thresh)):
+        region = finder(source)
+        if region is None:
+            continue
+        x, y, w, h = region
+        if w < width * ROI_MIN_WIDTH_FRACTION or w * h > width * height * ROI_MAX_AREA_FRACTION:
+            continue
+        x0 = max(x - ROI_PADDING, 0)
+        y0 = max(y - ROI_PADDING, 0)
+        x1 = min(x + w + ROI_PADDING, width)
+        y1 = min(y + h + ROI_PADDING, height)
+        logging.info(f"Table region found by {finder.__name__}: {x1 - x0}x{y1 - y0} of {width}x{height}")
+        return x0, y0, x1 - x0, y1 - y0
+    return None
+
+def split_into_row_bands(thresh):
+    """Split a thresholded (white text on black) image into horizontal text-line
+    bands using its row projection profile. Returns (top, bottom) pairs."""
+    import numpy as np
+    height = thresh.shape[0]
+    text_rows = np.flatnonzero(np.count_nonzero(thresh, axis=1))
+    if text_rows.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(text_rows) > ROW_MIN_GAP)
+    starts = np.concatenate(([text_rows[0]], text_rows[breaks + 1]))
+    ends = np.concatenate((text_rows[breaks], [text_rows[-1]]))
+    bands = []
+    for start, end in zip(starts, ends):
+        if end - start + 1 < ROW_MIN_HEIGHT:
+            continue
+        bands.append((max(int(start) - ROW_PADDING, 0), min(int(end) + 1 + ROW_PADDING, height)))
+    return bands
+
+def ocr_row_bands(processed_img, bands):
+    import pytesseract
+    def ocr_band(band):
+        top, bottom = band
+        return pytesseract.image_to_string(processed_img[top:bottom], config=ROW_TESSERACT_CONFIG).strip()
+
+    # pytesseract runs tesseract as a subprocess, so threads are enough to use every core.
+    with ThreadPoolExecutor(max_workers=max(OCR_ROW_WORKERS, 1)) as executor:
+        lines = list(executor.map(ocr_band, bands))
+    return '\n'.join(line for line in lines if line)
+
+def preprocess_image(image_bytes):
+    """Decode an upload and turn it into the cropped binary image Tesseract reads."""
+    timings = {}
+    started = time_module.perf_counter()
+    img = decode_image(image_bytes)
+    if img is None:
+        raise ValueError("Could not decode image data")
     
-    img = cv2.imread(image_path)
+    gray = preprocess_engine.grayscale(img)
+    timings['decode'] = time_module.perf_counter() - started
     
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    started = time_module.perf_counter()
+    scale, text_height = 1.0, None
+    if OCR_NORMALIZE:
+        gray, scale, text_height = normalize_resolution(gray)
+    timings['normalize'] = time_module.perf_counter() - started
     
-    _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
+    started = time_module.perf_counter()
+    thresh = preprocess_engine.binarize(gray, OCR_THRESHOLD_MODE)
+    processed_img = preprocess_engine.denoise(thresh)
+    timings['threshold'] = time_module.perf_counter() - started
     
-    kernel = np.ones((1, 1), np.uint8)
-    processed_img = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
+    started = time_module.perf_counter()
+    if OCR_ROI_ENABLED:
+        region = find_table_region(gray, processed_img)
+        if region:
+            x, y, w, h = region
+            processed_img = processed_img[y:y + h, x:x + w]
+    timings['roi'] = time_module.perf_counter() - started
     
-    custom_config = r'--oem 3 --psm 6'
+    height_str = f"{text_height:.1f}px" if text_height else 'unknown'
+    logging.info(
+        f"Preprocessed {img.shape[1]}x{img.shape[0]} -> {processed_img.shape[1]}x{processed_img.shape[0]}, "
+        f"text height {height_str}, scale {scale:.2f}, threshold {OCR_THRESHOLD_MODE}, denoise {OCR_DENOISE}; "
+        + ', '.join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in timings.items())
+    )
+    return processed_img
+
+@instrumented('extract_text_from_image')
+def extract_text_from_image(image_bytes, row_parallel=None):
+    import pytesseract
+    if row_parallel is None:
+        row_parallel = OCR_ROW_PARALLEL
+    output = 'rows' if row_parallel else 'text'
+    cache_key = ocr_cache_key(image_bytes, output)
+    text = ocr_cache.get(cache_key)
+    if text is not None:
+        logging.info(f"OCR cache hit: {ocr_cache.stats()}")
+        return text
     
-    text = pytesseract.image_to_string(processed_img, config=custom_config)
+    processed_img = preprocess_image(image_bytes)
+    
+    started = time_module.perf_counter()
+    if row_parallel:
+        bands = split_into_row_bands(processed_img)
+        logging.info(f"OCR over {len(bands)} row bands with {OCR_ROW_WORKERS} workers")
+        text = ocr_row_bands(processed_img, bands)
+    else:
+        text = pytesseract.image_to_string(processed_img, config=TESSERACT_CONFIG)
+    logging.info(f"OCR took {(time_module.perf_counter() - started) * 1000:.1f}ms")
+    ocr_cache.put(cache_key, text)
     return text
 
-def parse_schedule(text):
-    events = []
-    lines = text.splitlines()
+@instrumented('extract_words_from_image')
+def extract_words_from_image(image_bytes):
+    """Word-level OCR as Tesseract's TSV (image_to_data) output."""
+    import pytesseract
+    cache_key = ocr_cache_key(image_bytes, 'data')
+    tsv = ocr_cache.get(cache_key)
+    if tsv is not None:
+        logging.info(f"OCR cache hit: {ocr_cache.stats()}")
+        return tsv
+    
+    processed_img = preprocess_image(image_bytes)
+    
+    started = time_module.perf_counter()
+    tsv = pytesseract.image_to_data(processed_img, config=TESSERACT_CONFIG)
+    logging.info(f"OCR took {(time_module.perf_counter() - started) * 1000:.1f}ms")
+    ocr_cache.put(cache_key, tsv)
+    return tsv
+
+CLASS_NUM_PREFIX_RE = re.compile(r'^\d{5,6}')
+CLASS_NUM_RE = re.compile(r'^\d{5,6}$')
+COURSE_CODE_RE = re.compile(r'^[A-Z]{2,4}\s?\d{3}$')
+COURSE_CODE_SINGLE_RE = re.compile(r'^[A-Z]{2,4}\d{3}$')
+UNITS_RE = re.compile(r'^\d+\.\d+$')
+DATE_TOKEN_RE = re.compile(r'^\d{1,2}/\d{1,2}/\d{2}$')
+TIME_RANGE_RE = re.compile(
+    r'(\d{1,2}:\d{2}\s?(AM|PM))\s*[-–—]\s*(\d{1,2}:\d{2}\s?(AM|PM))',
+    re.IGNORECASE
+)
+DATE_RANGE_RE = re.compile(r'(\d{1,2}/\d{1,2}/\d{2})\s*[-–—]\s*(\d{1,2}/\d{1,2}/\d{2})')
+TIME_AMPM_RE = re.compile(r'(\d)(AM|PM)')
+
+DAY_ABBREVIATIONS = frozenset(['M', 'Tu', 'W', 'Th', 'F', 'Sa', 'Su', 'MW', 'MF', 'MWF', 'TBA', 'Arranged'])
+DAY_MAPPING = {
+    'M': ('MO',),
+    'TU': ('TU',),
+    'W': ('WE',),
+    'TH': ('TH',),
+    'F': ('FR',),
+    'SA': ('SA',),
+    'SU': ('SU',),
+    'MW': ('MO', 'WE'),
+    'MWF': ('MO', 'WE', 'FR'),
+    'TUTH': ('TU', 'TH'),
+    'MTWTHF': ('MO', 'TU', 'WE', 'TH', 'FR'),
+    'TBA': (),
+    'ARRANGED': ()
+}
+REVERSE_DAY_MAPPING = {
+    'MO': 'M',
+    'TU': 'Tu',
+    'WE': 'W',
+    'TH': 'Th',
+    'FR': 'F',
+    'SA': 'Sa',
+    'SU': 'Su'
+}
+
+@lru_cache(maxsize=None)
+def get_phoenix_tz():
+    import pytz
+    return pytz.timezone('America/Phoenix')
+
+DATETIME_FORMAT = '%m/%d/%y %I:%M %p'
+DATE_FORMAT = '%m/%d/%y'
+
+@lru_cache(maxsize=1024)
+def parse_datetime(value, fmt):
+    """strptime, memoized: a schedule repeats the same few dates and times."""
+    return datetime.strptime(value, fmt)
+
+class _Unset:
+    """Marks a cached value that has not been computed yet. Pickles by name, so an
+    event sent through the OCR process pool still compares `is _UNSET`."""
+
+    def __reduce__(self):
+        return '_UNSET'
+
+    def __repr__(self):
+        return '_UNSET'
+
+_UNSET = _Unset()
+
+@dataclass(slots=True)
+class ScheduleEvent:
+    """One class section from the schedule. Datetimes and the RRULE are derived
+    lazily from the parsed strings and cached on the instance."""
+    summary: str
+    class_num: str
+    units: str
+    instructors: str
+    days_str: str
+    time_str: str
+    date_str: str
+    location: str
+    days_of_week: list
+    start_time_str: str = None
+    end_time_str: str = None
+    start_date_str: str = None
+    end_date_str: str = None
+    id: str = ''
+    _start: object = field(default=_UNSET, init=False, repr=False, compare=False)
+    _end: object = field(default=_UNSET, init=False, repr=False, compare=False)
+    _end_date: object = field(default=_UNSET, init=False, repr=False, compare=False)
+    _rrule: object = field(default=_UNSET, init=False, repr=False, compare=False)
+
+    @property
+    def start(self):
+        if self._start is _UNSET:
+            self._start = self._localize(self.start_time_str)
+        return self._start
+
+    @property
+    def end(self):
+        if self._end is _UNSET:
+            self._end = self._localize(self.end_time_str)
+        return self._end
+
+    @property
+    def end_date(self):
+        if self._end_date is _UNSET:
+            self._end_date = parse_datetime(self.end_date_str, DATE_FORMAT) if self.end_date_str else None
+        return self._end_date
+
+    @property
+    def rrule(self):
+        if self._rrule is _UNSET:
+            self._rrule = None
+            if self.days_of_week and self.end_date:
+                until_datetime = get_phoenix_tz().localize(datetime.combine(self.end_date, datetime.max.time()))
+                until_date_str = until_datetime.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+                self._rrule = f"RRULE:FREQ=WEEKLY;BYDAY={','.join(self.days_of_week)};UNTIL={until_date_str}"
+        return self._rrule
+
+    @property
+    def term(self):
+        """The date span the section runs over, e.g. '20240822-20241206'; used to
+        tag calendar events so a later upload can sync against them."""
+        if not (self.start_date_str and self.end_date_str):
+            return None
+        start_date = parse_datetime(self.start_date_str, DATE_FORMAT)
+        return f"{start_date:%Y%m%d}-{self.end_date:%Y%m%d}"
+
+    def is_schedulable(self):
+        """Whether the event can go on a calendar. Raises ValueError for malformed
+        dates or times; the localized values stay cached either way."""
+        self.end_date
+        return bool(self.start and self.end and self.days_of_week)
+
+    def _localize(self, time_str):
+        if not (self.start_date_str and time_str):
+            return None
+        return get_phoenix_tz().localize(parse_datetime(f"{self.start_date_str} {time_str}", DATETIME_FORMAT))
+
+    @property
+    def display_days(self):
+        return ', '.join(REVERSE_DAY_MAPPING.get(day, day) for day in self.days_of_week)
+
+    def as_dict(self):
+        data = {name: getattr(self, name) for name in SESSION_FIELDS}
+        data['start'] = self.start.isoformat() if self.start else None
+        data['end'] = self.end.isoformat() if self.end else None
+        data['rrule'] = self.rrule
+        return data
+
+    def to_session(self):
+        """Positional list of the parsed fields (keys are implied by SESSION_FIELDS),
+        followed by the precomputed start/end timestamps and RRULE."""
+        values = [getattr(self, name) for name in SESSION_FIELDS]
+        values.append(int(self.start.timestamp()) if self.start else None)
+        values.append(int(self.end.timestamp()) if self.end else None)
+        values.append(self.rrule)
+        return values
+
+    @classmethod
+    def from_session(cls, values):
+        event = cls(**dict(zip(SESSION_FIELDS, values)))
+        precomputed = values[len(SESSION_FIELDS):]
+        if len(precomputed) == 3:
+            start_ts, end_ts, rrule = precomputed
+            # fromtimestamp with a fixed-offset zone is far cheaper than strptime + localize.
+            event._start = datetime.fromtimestamp(start_ts, get_phoenix_tz()) if start_ts is not None else None
+            event._end = datetime.fromtimestamp(end_ts, get_phoenix_tz()) if end_ts is not None else None
+            event._rrule = rrule
+        return event
+
+SESSION_FIELDS = tuple(f.name for f in fields(ScheduleEvent) if f.init)
+
+TOKEN_OTHER = 0
+TOKEN_UNITS = 1
+TOKEN_DAY = 2
+TOKEN_DATE = 3
+TOKEN_LOCATION = 4
+
+def classify_token(token):
+    if token in DAY_ABBREVIATIONS:
+        return TOKEN_DAY
+    if UNITS_RE.match(token):
+        return TOKEN_UNITS
+    if DATE_TOKEN_RE.match(token):
+        return TOKEN_DATE
+    if token.startswith('Tempe'):
+        return TOKEN_LOCATION
+    return TOKEN_OTHER
+
+def combine_schedule_lines(text):
+    """Glue OCR lines into one line per class, starting a new row at each class number."""
     combined_lines = []
     buffer = ''
-    for line in lines:
+    for line in text.splitlines():
         stripped_line = line.strip()
-        if re.match(r'^\d{5,6}', stripped_line):
+        if CLASS_NUM_PREFIX_RE.match(stripped_line):
             if buffer:
                 combined_lines.append(buffer)
             buffer = stripped_line
@@ -77,230 +797,956 @@ def parse_schedule(text):
             buffer += ' ' + stripped_line
     if buffer:
         combined_lines.append(buffer)
-    for line in combined_lines:
+    return combined_lines
+
+def map_days(days_str):
+    days_list = days_str.upper().replace(',', '').split()
+    mapped_days = DAY_MAPPING.get(''.join(days_list))
+    if mapped_days is not None:
+        return list(mapped_days)
+    event_days = []
+    for day in days_list:
+        mapped_day = DAY_MAPPING.get(day)
+        if mapped_day:
+            event_days.extend(mapped_day)
+        else:
+            logging.warning(f"Unrecognized day: {day}")
+    return event_days
+
+def build_schedule_event(parsed, log_details=False):
+    """Turn parse_line-style column strings into a ScheduleEvent, or None if the
+    row cannot go on a calendar. Raises ValueError for malformed dates or times."""
+    event = ScheduleEvent(days_of_week=map_days(parsed['days_str']), **parsed)
+    
+    time_range_match = TIME_RANGE_RE.search(event.time_str)
+    if time_range_match:
+        event.start_time_str = normalize_time_format(time_range_match.group(1))
+        event.end_time_str = normalize_time_format(time_range_match.group(3))
+    
+    date_range_match = DATE_RANGE_RE.search(event.date_str)
+    if date_range_match:
+        event.start_date_str = date_range_match.group(1)
+        event.end_date_str = date_range_match.group(2)
+    
+    schedulable = event.is_schedulable()
+    if schedulable:
+        event.id = str(uuid.uuid4())
+    if log_details:
+        logging.log(EVENT_LOG_LEVEL, f"Parsing event: {event.summary}")
+        logging.log(EVENT_LOG_LEVEL, f"Extracted start time: {event.start_time_str}")
+        logging.log(EVENT_LOG_LEVEL, f"Extracted end time: {event.end_time_str}")
+        logging.log(EVENT_LOG_LEVEL, f"Days of week for event: {event.days_of_week}")
+    return event if schedulable else None
+
+@instrumented('parse_schedule')
+def parse_schedule(text):
+    events = []
+    log_details = event_logging_enabled()
+    for line in combine_schedule_lines(text):
         if not line.strip():
             continue
         if 'icourse' in line.lower():
             continue
         try:
-            event = parse_line(line)
-            if not event:
+            parsed = parse_line(line)
+            if not parsed:
                 continue
-            
-            day_mapping = {
-                'M': 'MO',
-                'TU': 'TU',
-                'W': 'WE',
-                'TH': 'TH',
-                'F': 'FR',
-                'SA': 'SA',
-                'SU': 'SU',
-                'MW': ['MO', 'WE'],
-                'MWF': ['MO', 'WE', 'FR'],
-                'TUTH': ['TU', 'TH'],
-                'MTWTHF': ['MO', 'TU', 'WE', 'TH', 'FR'],
-                'TBA': [],
-                'ARRANGED': []
-            }
-            days_list = event['days_str'].upper().replace(',', '').split()
-            days_combined = ''.join(days_list)
-            if days_combined in day_mapping:
-                mapped_days = day_mapping[days_combined]
-                event_days = mapped_days if isinstance(mapped_days, list) else [mapped_days]
-            else:
-                
-                event_days = []
-                for day in days_list:
-                    day = day.strip().upper()
-                    mapped_day = day_mapping.get(day)
-                    if mapped_day:
-                        if isinstance(mapped_day, list):
-                            event_days.extend(mapped_day)
-                        else:
-                            event_days.append(mapped_day)
-                    else:
-                        logging.warning(f"Unrecognized day: {day}")
-            event['days_of_week'] = event_days
-            
-            time_range_match = re.search(
-                r'(\d{1,2}:\d{2}\s?(AM|PM))\s*[-–—]\s*(\d{1,2}:\d{2}\s?(AM|PM))',
-                event['time_str'],
-                re.IGNORECASE
-            )
-            if time_range_match:
-                event['start_time_str'] = normalize_time_format(time_range_match.group(1))
-                event['end_time_str'] = normalize_time_format(time_range_match.group(3))
-            else:
-                event['start_time_str'] = None
-                event['end_time_str'] = None
-            
-            date_range_match = re.search(
-                r'(\d{1,2}/\d{1,2}/\d{2})\s*[-–—]\s*(\d{1,2}/\d{1,2}/\d{2})',
-                event['date_str']
-            )
-            if date_range_match:
-                event['start_date_str'] = date_range_match.group(1)
-                event['end_date_str'] = date_range_match.group(2)
-            else:
-                event['start_date_str'] = None
-                event['end_date_str'] = None
-            tz = pytz.timezone('America/Phoenix')  
-            
-            if 'start_date_str' in event and event['start_date_str'] and event['start_time_str']:
-                start_datetime_str = f"{event['start_date_str']} {event['start_time_str']}"
-                naive_start = datetime.strptime(start_datetime_str, '%m/%d/%y %I:%M %p')
-                event['start'] = tz.localize(naive_start)
-                logging.info(f"Localized start time: {event['start']}")
-            else:
-                event['start'] = None
-            
-            if 'start_date_str' in event and event['start_date_str'] and event['end_time_str']:
-                end_datetime_str = f"{event['start_date_str']} {event['end_time_str']}"
-                naive_end = datetime.strptime(end_datetime_str, '%m/%d/%y %I:%M %p')
-                event['end'] = tz.localize(naive_end)
-                logging.info(f"Localized end time: {event['end']}")
-            else:
-                event['end'] = None
-            if 'end_date_str' in event and event['end_date_str']:
-                event['end_date'] = datetime.strptime(event['end_date_str'], '%m/%d/%y')
-            else:
-                event['end_date'] = None
-            if event['start'] and event['end'] and event['days_of_week']:
-                
-                event['id'] = str(uuid.uuid4())
-                event.pop('start', None)
-                event.pop('end', None)
-                event.pop('end_date', None)
+            event = build_schedule_event(parsed, log_details)
+            if event:
                 events.append(event)
-            logging.info(f"Parsing event: {event['summary']}")
-            logging.info(f"Extracted start time: {event.get('start_time_str')}")
-            logging.info(f"Extracted end time: {event.get('end_time_str')}")
-            logging.info(f"Days of week for event: {event.get('days_of_week')}")
         except Exception as e:
             logging.error(f"Error parsing line: {line}")
             logging.error(f"Exception: {e}")
             continue
     return events
+
+OCRWord = namedtuple('OCRWord', ['text', 'left', 'top', 'line_key'])
+
+# Schedule table columns in order: (parse_line field, header word prefix).
+STRUCTURED_COLUMNS = (
+    ('class_num', 'class'),
+    ('course', 'course'),
+    ('title', 'title'),
+    ('units', 'units'),
+    ('instructors', 'instructor'),
+    ('days_str', 'days'),
+    ('time_str', 'start'),
+    ('date_str', 'dates'),
+    ('location', 'location'),
+)
+STRUCTURED_REQUIRED_COLUMNS = {'class_num', 'course', 'units', 'days_str', 'time_str', 'date_str'}
+STRUCTURED_COLUMN_TOLERANCE = 10
+
+def parse_tsv_words(tsv):
+    lines = tsv.splitlines()
+    if not lines:
+        return []
+    header = {name: i for i, name in enumerate(lines[0].split('\t'))}
+    width = len(header)
+    text_i, conf_i = header['text'], header['conf']
+    left_i, top_i = header['left'], header['top']
+    block_i, par_i, line_i = header['block_num'], header['par_num'], header['line_num']
+    words = []
+    for line in lines[1:]:
+        values = line.split('\t')
+        if len(values) != width or values[conf_i] == '-1':
+            continue
+        text = values[text_i].strip()
+        if not text:
+            continue
+        words.append(OCRWord(text, int(values[left_i]), int(values[top_i]),
+                             (values[block_i], values[par_i], values[line_i])))
+    return words
+
+def group_words_into_lines(words):
+    lines = {}
+    for word in words:
+        lines.setdefault(word.line_key, []).append(word)
+    ordered = sorted(lines.values(), key=lambda line: min(word.top for word in line))
+    return [sorted(line, key=lambda word: word.left) for line in ordered]
+
+def find_column_layout(lines):
+    """Locate the header row. Returns (header_line_index, [(field, left), ...]) or None."""
+    for index, line in enumerate(lines):
+        columns = []
+        remaining = list(line)
+        for name, prefix in STRUCTURED_COLUMNS:
+            for word in remaining:
+                if word.text.lower().startswith(prefix):
+                    columns.append((name, word.left))
+                    remaining.remove(word)
+                    break
+        if STRUCTURED_REQUIRED_COLUMNS <= {name for name, _ in columns}:
+            return index, sorted(columns, key=lambda column: column[1])
+    return None
+
+def structured_row_fields(cells):
+    text = {name: ' '.join(cells.get(name, [])) for name, _ in STRUCTURED_COLUMNS}
+    course_code = text['course']
+    if not (CLASS_NUM_RE.match(text['class_num']) and COURSE_CODE_RE.match(course_code)
+            and UNITS_RE.match(text['units'])):
+        # Column boundaries were off for this row; fall back to the token parser.
+        return parse_line(' '.join(text[name] for name, _ in STRUCTURED_COLUMNS))
+    return {
+        'summary': f"{course_code} - {text['title']}",
+        'class_num': text['class_num'],
+        'units': text['units'],
+        'instructors': text['instructors'],
+        'days_str': text['days_str'],
+        'time_str': text['time_str'],
+        'date_str': text['date_str'],
+        'location': text['location'],
+    }
+
+@instrumented('parse_structured_schedule')
+def parse_structured_schedule(tsv):
+    """Build events from word boxes by assigning each word to a table column by
+    its x position. Falls back to parse_schedule when no header row is found."""
+    lines = group_words_into_lines(parse_tsv_words(tsv))
+    layout = find_column_layout(lines)
+    if layout is None:
+        logging.info("No schedule header found in word boxes; using line parser")
+        return parse_schedule('\n'.join(' '.join(word.text for word in line) for line in lines))
+    header_index, columns = layout
+    names = [name for name, _ in columns]
+    lefts = [left - STRUCTURED_COLUMN_TOLERANCE for _, left in columns]
+    rows = []
+    for line in lines[header_index + 1:]:
+        cells = {}
+        for word in line:
+            column = max(bisect_right(lefts, word.left) - 1, 0)
+            cells.setdefault(names[column], []).append(word.text)
+        class_cell = cells.get('class_num')
+        if class_cell and CLASS_NUM_RE.match(class_cell[0]):
+            rows.append(cells)
+        elif rows:
+            # Continuation of a wrapped cell in the previous row.
+            for name, texts in cells.items():
+                rows[-1].setdefault(name, []).extend(texts)
+    events = []
+    log_details = event_logging_enabled()
+    for cells in rows:
+        if any('icourse' in text.lower() for texts in cells.values() for text in texts):
+            continue
+        try:
+            parsed = structured_row_fields(cells)
+            if not parsed:
+                continue
+            event = build_schedule_event(parsed, log_details)
+            if event:
+                events.append(event)
+        except Exception as e:
+            logging.error(f"Error parsing row: {cells}")
+            logging.error(f"Exception: {e}")
+    return events
+
+def extract_events_from_image(image_bytes):
+    if OCR_MODE == 'structured':
+        return parse_structured_schedule(extract_words_from_image(image_bytes))
+    return parse_schedule(extract_text_from_image(image_bytes))
+
 def normalize_time_format(time_str):
     """Ensure there is a space between the time and AM/PM."""
-    return re.sub(r'(\d)(AM|PM)', r'\1 \2', time_str)
+    return TIME_AMPM_RE.sub(r'\1 \2', time_str)
+def find_token(kinds, kind, index):
+    count = len(kinds)
+    while index < count and kinds[index] != kind:
+        index += 1
+    return index
 def parse_line(line):
-    tokens = line.strip().split()
-    index = 0
+    tokens = line.split()
+    count = len(tokens)
     
-    if index < len(tokens) and re.match(r'^\d{5,6}$', tokens[index]):
-        class_num = tokens[index]
-        index +=1
+    if count and CLASS_NUM_RE.match(tokens[0]):
+        class_num = tokens[0]
     else:
         logging.error("No class number found")
         return None
     
-    if index+1 < len(tokens):
-        course_code = tokens[index] + ' ' + tokens[index+1]
-        if re.match(r'^[A-Z]{2,4}\s?\d{3}$', course_code):
-            index +=2
+    if count > 2:
+        course_code = tokens[1] + ' ' + tokens[2]
+        if COURSE_CODE_RE.match(course_code):
+            index = 3
+        elif COURSE_CODE_SINGLE_RE.match(tokens[1]):
+            course_code = tokens[1]
+            index = 2
         else:
-            
-            course_code = tokens[index]
-            if re.match(r'^[A-Z]{2,4}\d{3}$', course_code):
-                index +=1
-            else:
-                logging.error("No course code found")
-                return None
+            logging.error("No course code found")
+            return None
     else:
         logging.error("No course code found")
         return None
     
-    title_tokens = []
-    while index < len(tokens) and not re.match(r'^\d+\.\d+$', tokens[index]):
-        title_tokens.append(tokens[index])
-        index +=1
-    title = ' '.join(title_tokens)
+    # Classify every token once, then split the row at the column boundaries:
+    # title | units | instructors | days | time | dates | location
+    kinds = [TOKEN_OTHER] * index + [classify_token(token) for token in tokens[index:]]
     
-    if index < len(tokens) and re.match(r'^\d+\.\d+$', tokens[index]):
-        units = tokens[index]
-        index +=1
-    else:
+    units_index = find_token(kinds, TOKEN_UNITS, index)
+    if units_index == count:
         logging.error("No units found")
         return None
-    
-    day_abbreviations = ['M','Tu','W','Th','F','Sa','Su','MW','MF','MWF','TBA','Arranged']
-    instructor_tokens = []
-    while index < len(tokens) and tokens[index] not in day_abbreviations:
-        instructor_tokens.append(tokens[index])
-        index +=1
-    instructors = ' '.join(instructor_tokens)
-    
-    days_tokens = []
-    while index < len(tokens) and tokens[index] in day_abbreviations:
-        days_tokens.append(tokens[index])
-        index +=1
-    days_str = ' '.join(days_tokens)
-    
-    time_tokens = []
-    while index < len(tokens) and not re.match(r'^\d{1,2}/\d{1,2}/\d{2}$', tokens[index]):
-        time_tokens.append(tokens[index])
-        index +=1
-    time_str = ' '.join(time_tokens)
-    
-    date_tokens = []
-    while index < len(tokens) and not tokens[index].startswith('Tempe'):
-        date_tokens.append(tokens[index])
-        index +=1
-    date_str = ' '.join(date_tokens)
-    
-    location_tokens = tokens[index:]
-    location = ' '.join(location_tokens)
+    days_start = find_token(kinds, TOKEN_DAY, units_index + 1)
+    days_end = days_start
+    while days_end < count and kinds[days_end] == TOKEN_DAY:
+        days_end += 1
+    dates_start = find_token(kinds, TOKEN_DATE, days_end)
+    location_start = find_token(kinds, TOKEN_LOCATION, dates_start)
     
     event = {}
-    event['summary'] = f"{course_code} - {title}"
+    event['summary'] = f"{course_code} - {' '.join(tokens[index:units_index])}"
     event['class_num'] = class_num
-    event['units'] = units
-    event['instructors'] = instructors
-    event['days_str'] = days_str
-    event['time_str'] = time_str
-    event['date_str'] = date_str
-    event['location'] = location
+    event['units'] = tokens[units_index]
+    event['instructors'] = ' '.join(tokens[units_index + 1:days_start])
+    event['days_str'] = ' '.join(tokens[days_start:days_end])
+    event['time_str'] = ' '.join(tokens[days_end:dates_start])
+    event['date_str'] = ' '.join(tokens[dates_start:location_start])
+    event['location'] = ' '.join(tokens[location_start:])
     return event
-def add_events_to_calendar(events, credentials):
-    service = get_calendar_service(credentials)
+CALENDAR_BATCH_SIZE = 50
+CALENDAR_MAX_RETRIES = 3
+CALENDAR_RETRY_BASE_DELAY = 1.0
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+CLASS_NUM_PROPERTY = 'asuClassNum'
+TERM_PROPERTY = 'asuTerm'
+
+def build_event_body(event):
+    return {
+        'summary': event.summary,
+        'location': event.location,
+        'start': {
+            'dateTime': event.start.isoformat(),
+            'timeZone': 'America/Phoenix'
+        },
+        'end': {
+            'dateTime': event.end.isoformat(),
+            'timeZone': 'America/Phoenix'
+        },
+        'recurrence': [event.rrule] if event.rrule else None,
+        'extendedProperties': {
+            'private': {
+                CLASS_NUM_PROPERTY: event.class_num,
+                TERM_PROPERTY: event.term or ''
+            }
+        }
+    }
+
+def calendar_transport_errors():
+    """Exceptions a batch call can raise without any per-request response: socket
+    timeouts and resets, httplib2 failures and credential refresh errors."""
+    import httplib2
+    from google.auth.exceptions import GoogleAuthError
+    from googleapiclient.errors import HttpError
+    return (HttpError, httplib2.HttpLib2Error, GoogleAuthError, OSError)
+
+def is_retryable_error(exception):
+    import httplib2
+    from google.auth.exceptions import TransportError
+    from googleapiclient.errors import HttpError
+    if isinstance(exception, HttpError):
+        return int(exception.resp.status) in RETRYABLE_STATUS_CODES
+    return isinstance(exception, (httplib2.HttpLib2Error, TransportError, OSError))
+
+def is_duplicate_error(exception):
+    from googleapiclient.errors import HttpError
+    return isinstance(exception, HttpError) and int(exception.resp.status) == 409
+
+def insert_event_request(service, calendar_id, body):
+    """Request factory for events.insert with a client-generated event id, so a
+    retry after a lost response gets 409 instead of creating a duplicate."""
+    body = dict(body, id=uuid.uuid4().hex)
+    return lambda: service.events().insert(calendarId=calendar_id, body=body)
+
+def execute_calendar_batch(service, requests_by_id):
+    """Run request factories through batched HTTP calls, retrying transient errors.
+
+    requests_by_id maps a request id to a zero-argument callable returning a fresh
+    HttpRequest, so that failed requests can be rebuilt for a retry. Returns a dict
+    of request id -> (response, exception).
+    """
+    transport_errors = calendar_transport_errors()
+    results = {}
+    pending = list(requests_by_id)
+    attempt = 0
+    while pending:
+        retry = []
+
+        def callback(request_id, response, exception):
+            if exception is not None and is_retryable_error(exception) and attempt < CALENDAR_MAX_RETRIES:
+                retry.append(request_id)
+            else:
+                results[request_id] = (response, exception)
+
+        for offset in range(0, len(pending), CALENDAR_BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=callback)
+            for request_id in pending[offset:offset + CALENDAR_BATCH_SIZE]:
+                batch.add(requests_by_id[request_id](), request_id=request_id)
+            try:
+                with timed_stage('calendar_batch'):
+                    batch.execute()
+            except transport_errors as e:
+                logging.warning(f"Calendar batch request failed: {e!r}")
+                for request_id in pending[offset:offset + CALENDAR_BATCH_SIZE]:
+                    if request_id in results or request_id in retry:
+                        continue
+                    callback(request_id, None, e)
+        if retry:
+            delay = CALENDAR_RETRY_BASE_DELAY * (2 ** attempt) + random.uniform(0, CALENDAR_RETRY_BASE_DELAY)
+            logging.warning(f"Retrying {len(retry)} calendar request(s) in {delay:.1f}s")
+            time_module.sleep(delay)
+        pending = retry
+        attempt += 1
+    return results
+
+def run_with_calendar_service(body, events, credentials, service):
+    """body(events, service), with a service checked out for the credentials
+    when none is given."""
+    if service is not None:
+        return body(events, service)
+    with calendar_service(credentials) as service:
+        return body(events, service)
+
+@instrumented('add_events_to_calendar')
+def add_events_to_calendar(events, credentials, service=None):
+    return run_with_calendar_service(insert_calendar_events, events, credentials, service)
+
+def insert_calendar_events(events, service):
+    log_details = event_logging_enabled()
     calendar_id = 'primary'
+    requests_by_id = {}
     for event in events:
-        
-        
-        if event['end_date']:
-            tz = pytz.timezone('America/Phoenix')
-            until_datetime = tz.localize(datetime.combine(event['end_date'], datetime.max.time()))
-            until_datetime_utc = until_datetime.astimezone(pytz.utc)
-            until_date_str = until_datetime_utc.strftime('%Y%m%dT%H%M%SZ')
+        event_body = build_event_body(event)
+        if log_details:
+            logging.log(EVENT_LOG_LEVEL, f"Adding event: {event_body}")
+        requests_by_id[event.id] = insert_event_request(service, calendar_id, event_body)
+    responses = execute_calendar_batch(service, requests_by_id)
+    results = []
+    for event in events:
+        _, exception = responses[event.id]
+        # A 409 on our own fresh id means an earlier attempt went through.
+        if exception is None or is_duplicate_error(exception):
+            if log_details:
+                logging.log(EVENT_LOG_LEVEL, f"Added event: {event.summary}")
+            results.append({'id': event.id, 'summary': event.summary, 'success': True, 'error': None})
         else:
-            until_date_str = None
-        if event['days_of_week'] and until_date_str:
-            recurrence_rule = f"RRULE:FREQ=WEEKLY;BYDAY={','.join(event['days_of_week'])};UNTIL={until_date_str}"
-            recurrence = [recurrence_rule]
+            logging.error(f"Failed to add event {event.summary}: {exception}")
+            results.append({'id': event.id, 'summary': event.summary, 'success': False, 'error': str(exception)})
+    return results
+
+def list_tagged_events(service, term):
+    """All calendar events previously added for a term, following nextPageToken."""
+    events = service.events()
+    list_request = events.list(
+        calendarId='primary',
+        privateExtendedProperty=f"{TERM_PROPERTY}={term}",
+        showDeleted=False,
+        maxResults=2500,
+        fields='items(id,summary,location,start,end,recurrence,extendedProperties),nextPageToken'
+    )
+    items = []
+    while list_request is not None:
+        with timed_stage('calendar_list'):
+            response = list_request.execute()
+        items.extend(response.get('items', []))
+        list_request = events.list_next(list_request, response)
+    return items
+
+def event_fingerprint(body):
+    def when(value):
+        date_time = (value or {}).get('dateTime')
+        if not date_time:
+            return None
+        # fromisoformat only accepts a trailing Z from Python 3.11 on.
+        return datetime.fromisoformat(date_time.replace('Z', '+00:00'))
+    return (body.get('summary') or '', body.get('location') or '', when(body.get('start')),
+            when(body.get('end')), tuple(body.get('recurrence') or ()))
+
+def is_missing_error(exception):
+    from googleapiclient.errors import HttpError
+    return isinstance(exception, HttpError) and int(exception.resp.status) in (404, 410)
+
+@instrumented('sync_events_to_calendar')
+def sync_events_to_calendar(events, credentials, service=None):
+    """Make the calendar match the given events for their terms: insert new
+    classes, patch changed ones and delete tagged events that are no longer
+    selected. Returns per-event results with the action taken."""
+    return run_with_calendar_service(apply_calendar_sync, events, credentials, service)
+
+def apply_calendar_sync(events, service):
+    calendar_id = 'primary'
+    existing = {}
+    for term in {event.term for event in events if event.term}:
+        for item in list_tagged_events(service, term):
+            class_num = item.get('extendedProperties', {}).get('private', {}).get(CLASS_NUM_PROPERTY)
+            existing.setdefault((term, class_num), []).append(item)
+    
+    requests_by_id = {}
+    planned = []
+    for event in events:
+        body = build_event_body(event)
+        fingerprint = event_fingerprint(body)
+        candidates = existing.get((event.term, event.class_num), [])
+        # A class number can cover several meetings; prefer an identical event.
+        match = next((item for item in candidates if event_fingerprint(item) == fingerprint), None)
+        if match is None and candidates:
+            match = candidates[0]
+        if match is not None:
+            candidates.remove(match)
+        if match is None:
+            planned.append(('insert', event.id, event.summary))
+            requests_by_id[f"insert:{event.id}"] = insert_event_request(service, calendar_id, body)
+        elif event_fingerprint(match) != fingerprint:
+            planned.append(('patch', event.id, event.summary))
+            requests_by_id[f"patch:{event.id}"] = (
+                lambda event_id=match['id'], body=body:
+                    service.events().patch(calendarId=calendar_id, eventId=event_id, body=body)
+            )
         else:
-            recurrence = None
-        event_body = {
-            'summary': event['summary'],
-            'location': event['location'],
-            'start': {
-                'dateTime': event['start'].isoformat(),
-                'timeZone': 'America/Phoenix'
-            },
-            'end': {
-                'dateTime': event['end'].isoformat(),
-                'timeZone': 'America/Phoenix'
-            },
-            'recurrence': recurrence
-        }
-        logging.info(f"Start datetime ISO format: {event['start'].isoformat()}")
-        logging.info(f"End datetime ISO format: {event['end'].isoformat()}")
-        logging.info(f"Adding event: {event_body}")
-        service.events().insert(calendarId=calendar_id, body=event_body).execute()
-        logging.info(f"Added event: {event['summary']}")
+            planned.append(('unchanged', event.id, event.summary))
+    for items in existing.values():
+        for item in items:
+            planned.append(('delete', item['id'], item.get('summary', '')))
+            requests_by_id[f"delete:{item['id']}"] = (
+                lambda event_id=item['id']: service.events().delete(calendarId=calendar_id, eventId=event_id)
+            )
+    
+    responses = execute_calendar_batch(service, requests_by_id) if requests_by_id else {}
+    results = []
+    for action, event_id, summary in planned:
+        exception = None
+        if action != 'unchanged':
+            _, exception = responses[f"{action}:{event_id}"]
+            if action == 'delete' and is_missing_error(exception):
+                exception = None
+            elif action == 'insert' and is_duplicate_error(exception):
+                exception = None
+        if exception is not None:
+            logging.error(f"Failed to {action} event {summary}: {exception}")
+        results.append({'id': event_id, 'summary': summary, 'action': action,
+                        'success': exception is None, 'error': str(exception) if exception else None})
+    counts = {action: sum(1 for result in results if result['action'] == action)
+              for action in ('insert', 'patch', 'delete', 'unchanged')}
+    logging.info(f"Calendar sync: {counts} using {len(requests_by_id)} write request(s)")
+    return results
+
+ICS_PRODID = '-//asu-schedule-automation//Schedule Export//EN'
+ICS_UID_DOMAIN = 'asu-schedule-automation'
+# Arizona does not observe DST, so a single STANDARD component covers every date.
+PHOENIX_VTIMEZONE = (
+    'BEGIN:VTIMEZONE\r\n'
+    'TZID:America/Phoenix\r\n'
+    'BEGIN:STANDARD\r\n'
+    'DTSTART:19700101T000000\r\n'
+    'TZOFFSETFROM:-0700\r\n'
+    'TZOFFSETTO:-0700\r\n'
+    'TZNAME:MST\r\n'
+    'END:STANDARD\r\n'
+    'END:VTIMEZONE\r\n'
+)
+ICS_HEADER = (
+    'BEGIN:VCALENDAR\r\n'
+    'VERSION:2.0\r\n'
+    f'PRODID:{ICS_PRODID}\r\n'
+    'CALSCALE:GREGORIAN\r\n'
+    'METHOD:PUBLISH\r\n'
+    + PHOENIX_VTIMEZONE
+)
+ICS_FOOTER = 'END:VCALENDAR\r\n'
+ICS_ESCAPES = str.maketrans({'\\': '\\\\', ';': '\\;', ',': '\\,', '\n': '\\n'})
+
+def escape_ics_text(value):
+    return value.translate(ICS_ESCAPES)
+
+def fold_ics_line(line):
+    """Content line with CRLF, folded at 75 octets as RFC 5545 requires."""
+    if len(line) <= 75 and line.isascii():
+        return line + '\r\n'
+    parts = []
+    current = []
+    current_size = 0
+    limit = 75
+    for char in line:
+        size = len(char.encode('utf-8'))
+        if current_size + size > limit:
+            parts.append(''.join(current))
+            current = []
+            current_size = 0
+            limit = 74  # continuation lines start with a space
+        current.append(char)
+        current_size += size
+    parts.append(''.join(current))
+    return '\r\n '.join(parts) + '\r\n'
+
+def generate_ics(events):
+    """Stream an iCalendar document for the events, one VEVENT per chunk.
+    Uses the same weekly RRULE as the Google Calendar path; no network calls."""
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield ICS_HEADER
+    for event in events:
+        # Stable per section so re-importing an updated schedule replaces it.
+        uid = f"{event.term}-{event.class_num}-{''.join(event.days_of_week)}-{event.start:%H%M}@{ICS_UID_DOMAIN}"
+        lines = [
+            'BEGIN:VEVENT',
+            f'UID:{uid}',
+            f'DTSTAMP:{stamp}',
+            f'DTSTART;TZID=America/Phoenix:{event.start:%Y%m%dT%H%M%S}',
+            f'DTEND;TZID=America/Phoenix:{event.end:%Y%m%dT%H%M%S}',
+            f'SUMMARY:{escape_ics_text(event.summary)}',
+        ]
+        if event.location:
+            lines.append(f'LOCATION:{escape_ics_text(event.location)}')
+        if event.rrule:
+            lines.append(event.rrule)
+        lines.append('END:VEVENT')
+        yield ''.join(fold_ics_line(line) for line in lines)
+    yield ICS_FOOTER
+
+# memory and sqlite only work when every request reaches the same host; serverless
+# deploys (vercel.json) route a user's requests to whichever instance is free.
+SESSION_STORE = os.getenv('SESSION_STORE', 'cookie').lower()
+SESSION_STORE_PATH = os.getenv('SESSION_STORE_PATH', 'sessions.sqlite3')
+SESSION_STORE_SIZE = int(os.getenv('SESSION_STORE_SIZE', '1024'))
+SESSION_STORE_TTL = int(os.getenv('SESSION_STORE_TTL', '3600'))
+SESSION_COOKIE_WARN_BYTES = 3000
+if os.getenv('VERCEL') and SESSION_STORE != 'cookie':
+    raise ValueError(f"SESSION_STORE={SESSION_STORE} keeps events on one instance; use cookie on Vercel")
+
+class CookieSessionStore:
+    """Session payloads inside the signed session cookie itself, so any instance
+    can serve the next request."""
+
+    def get(self, key):
+        entry = session.get('events_data')
+        if not entry or entry[0] != key:
+            return None
+        return entry[1]
+
+    def put(self, key, data):
+        if len(data) > SESSION_COOKIE_WARN_BYTES:
+            logging.warning(f"{len(data)} byte event payload may not fit in the session cookie")
+        session['events_data'] = [key, data]
+
+    def delete(self, key):
+        session.pop('events_data', None)
+
+class MemorySessionStore:
+    """In-process LRU of session payloads with a per-entry TTL."""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires < time_module.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._entries[key] = (time_module.time() + self.ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+class SQLiteSessionStore:
+    """Session payloads in a local SQLite file, shared by every worker on the host."""
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)')
+
+    def _connect(self):
+        return closing_connection(sqlite3.connect(self.path, timeout=5))
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT data FROM sessions WHERE key = ? AND expires >= ?',
+                               (key, time_module.time())).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, data):
+        now = time_module.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO sessions (key, data, expires) VALUES (?, ?, ?)',
+                         (key, data, now + self.ttl))
+            conn.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE key = ?', (key,))
+
+@contextmanager
+def closing_connection(conn):
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def create_session_store():
+    if SESSION_STORE == 'cookie':
+        return CookieSessionStore()
+    if SESSION_STORE == 'memory':
+        return MemorySessionStore(SESSION_STORE_SIZE, SESSION_STORE_TTL)
+    if SESSION_STORE == 'sqlite':
+        return SQLiteSessionStore(SESSION_STORE_PATH, SESSION_STORE_TTL)
+    raise ValueError(f"Unknown SESSION_STORE: {SESSION_STORE} (expected cookie, memory or sqlite)")
+
+session_store = create_session_store()
+
+def store_session_events(events):
+    """Keep the parsed events, compressed, in the session store under an id kept
+    in the cookie (with the cookie store, the payload travels alongside it)."""
+    key = session.get('events_id') or uuid.uuid4().hex
+    payload = json.dumps([event.to_session() for event in events], separators=(',', ':'))
+    session_store.put(key, zlib.compress(payload.encode('utf-8')))
+    session['events_id'] = key
+
+def load_session_events():
+    key = session.get('events_id')
+    if not key:
+        return None
+    data = session_store.get(key)
+    if data is None:
+        return None
+    return [ScheduleEvent.from_session(values) for values in json.loads(zlib.decompress(data))]
+
+def clear_session_events():
+    key = session.pop('events_id', None)
+    if key:
+        session_store.delete(key)
+
+IMAGE_FETCH_CONNECT_TIMEOUT = float(os.getenv('IMAGE_FETCH_CONNECT_TIMEOUT', '3.05'))
+IMAGE_FETCH_READ_TIMEOUT = float(os.getenv('IMAGE_FETCH_READ_TIMEOUT', '10'))
+IMAGE_FETCH_DEADLINE = float(os.getenv('IMAGE_FETCH_DEADLINE', '20'))
+IMAGE_FETCH_MAX_BYTES = int(os.getenv('IMAGE_FETCH_MAX_BYTES', str(10 * 1024 * 1024)))
+IMAGE_FETCH_POOL_SIZE = int(os.getenv('IMAGE_FETCH_POOL_SIZE', '10'))
+IMAGE_FETCH_CHUNK_SIZE = 64 * 1024
+
+class ImageFetchError(Exception):
+    pass
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            http_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=IMAGE_FETCH_POOL_SIZE, pool_maxsize=IMAGE_FETCH_POOL_SIZE)
+            http_session.mount('http://', adapter)
+            http_session.mount('https://', adapter)
+            _http_session = http_session
+    return _http_session
+
+def iter_response_chunks(response):
+    """Yield body chunks as soon as any bytes arrive. iter_content() waits for a
+    whole chunk, so a slow drip would never reach the deadline check."""
+    read1 = getattr(response.raw, 'read1', None)
+    if read1 is None:
+        # urllib3 < 2 has no read1.
+        yield from response.iter_content(chunk_size=IMAGE_FETCH_CHUNK_SIZE)
+        return
+    while True:
+        chunk = read1(IMAGE_FETCH_CHUNK_SIZE, decode_content=True)
+        if not chunk:
+            return
+        yield chunk
+
+def fetch_image(url):
+    """Download an image URL into memory, refusing non-images and anything larger
+    than IMAGE_FETCH_MAX_BYTES. Raises ImageFetchError."""
+    import requests
+    import urllib3
+    if not url.lower().startswith(('http://', 'https://')):
+        raise ImageFetchError("Only http and https URLs are supported")
+    deadline = time_module.monotonic() + IMAGE_FETCH_DEADLINE
+    try:
+        with get_http_session().get(url, stream=True,
+                                    timeout=(IMAGE_FETCH_CONNECT_TIMEOUT, IMAGE_FETCH_READ_TIMEOUT)) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if not content_type.startswith('image/'):
+                raise ImageFetchError(f"Not an image (Content-Type: {content_type or 'missing'})")
+            content_length = response.headers.get('Content-Length', '')
+            if content_length.isdigit() and int(content_length) > IMAGE_FETCH_MAX_BYTES:
+                raise ImageFetchError(f"Image is {content_length} bytes, limit is {IMAGE_FETCH_MAX_BYTES}")
+            # Content-Length can be missing or wrong, so enforce the limit while reading too.
+            image_bytes = bytearray()
+            for chunk in iter_response_chunks(response):
+                image_bytes += chunk
+                if len(image_bytes) > IMAGE_FETCH_MAX_BYTES:
+                    raise ImageFetchError(f"Image exceeds {IMAGE_FETCH_MAX_BYTES} bytes")
+                if time_module.monotonic() > deadline:
+                    raise ImageFetchError(f"Download took longer than {IMAGE_FETCH_DEADLINE}s")
+    except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+        raise ImageFetchError(str(e)) from e
+    return image_bytes
+
+OCR_ASYNC = os.getenv('OCR_ASYNC', '').lower() in ('1', 'true', 'yes')
+# Job state lives in this process, so a /jobs poll that reaches another
+# serverless instance would find nothing.
+if os.getenv('VERCEL') and OCR_ASYNC:
+    raise ValueError("OCR_ASYNC keeps OCR jobs on one instance; leave it off on Vercel")
+OCR_POOL_SIZE = int(os.getenv('OCR_POOL_SIZE', str(os.cpu_count() or 1)))
+OCR_QUEUE_DEPTH = int(os.getenv('OCR_QUEUE_DEPTH', '32'))
+OCR_RETRY_AFTER = int(os.getenv('OCR_RETRY_AFTER', '5'))
+OCR_JOB_TTL = int(os.getenv('OCR_JOB_TTL', '600'))
+# Batches share the pool with async uploads; cap the queue slots they can hold
+# so an advisor's batch never leaves uploads with nothing but 503s.
+BATCH_MAX_IN_FLIGHT = int(os.getenv('BATCH_MAX_IN_FLIGHT', str(max(min(OCR_POOL_SIZE, OCR_QUEUE_DEPTH // 2), 1))))
+
+class OCRQueueFullError(Exception):
+    pass
+
+_ocr_pool = None
+_ocr_jobs = {}
+_ocr_jobs_lock = threading.Lock()
+
+_ocr_pool_lock = threading.Lock()
+_ocr_queue_slots = threading.BoundedSemaphore(OCR_QUEUE_DEPTH)
+_batch_slots = threading.BoundedSemaphore(BATCH_MAX_IN_FLIGHT)
+
+def init_ocr_worker():
+    # The pool already runs one image per core; row-parallel OCR inside each
+    # worker would start another cpu_count tesseracts per worker.
+    global OCR_ROW_WORKERS
+    if 'OCR_ROW_WORKERS' not in os.environ:
+        OCR_ROW_WORKERS = 1
+    # Pay for loading OpenCV and locating the tesseract binary once per worker,
+    # not inside the first job each worker picks up.
+    import cv2
+    import numpy
+    import pytesseract
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        logging.warning(f"Tesseract is not available in OCR worker: {e}")
+
+def get_ocr_pool():
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(max_workers=OCR_POOL_SIZE, initializer=init_ocr_worker)
+    return _ocr_pool
+
+def process_schedule_image(image_bytes):
+    return extract_events_from_image(image_bytes)
+
+def submit_ocr_task(image_bytes, batch=False):
+    """Queue an image on the shared OCR pool. Every task holds one of the
+    OCR_QUEUE_DEPTH slots until it finishes; uploads fail fast with
+    OCRQueueFullError when none is free, while batch images wait for one and also
+    hold one of the BATCH_MAX_IN_FLIGHT slots."""
+    slots = (_batch_slots, _ocr_queue_slots) if batch else (_ocr_queue_slots,)
+    acquired = []
+    try:
+        for slot in slots:
+            if not slot.acquire(blocking=batch):
+                raise OCRQueueFullError(f"All {OCR_QUEUE_DEPTH} OCR queue slots are in use")
+            acquired.append(slot)
+        future = get_ocr_pool().submit(process_schedule_image, image_bytes)
+    except BaseException:
+        for slot in acquired:
+            slot.release()
+        raise
+    def release_slots(_):
+        for slot in acquired:
+            slot.release()
+    future.add_done_callback(release_slots)
+    return future
+
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', '200'))
+BATCH_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+# A batch zip is the largest body anyone should post; werkzeug answers 413 past this.
+MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', str(64 * 1024 * 1024)))
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
+def is_batch_image(info):
+    return not info.is_dir() and info.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS)
+
+def count_batch_images(source):
+    """Number of images in one upload (a seekable binary file), from the zip
+    directory alone, without decompressing anything."""
+    is_zip = zipfile.is_zipfile(source)
+    source.seek(0)
+    if not is_zip:
+        return 1
+    with zipfile.ZipFile(source) as archive:
+        count = sum(1 for info in archive.infolist() if is_batch_image(info))
+    source.seek(0)
+    return count
+
+def read_batch_images(name, source):
+    """Yield (name, image_bytes, error) for one upload (a seekable binary file),
+    expanding zip archives one entry at a time."""
+    is_zip = zipfile.is_zipfile(source)
+    source.seek(0)
+    if not is_zip:
+        data = source.read(IMAGE_FETCH_MAX_BYTES + 1)
+        if len(data) > IMAGE_FETCH_MAX_BYTES:
+            yield name, None, f"Image exceeds {IMAGE_FETCH_MAX_BYTES} bytes"
+        else:
+            yield name, data, None
+        return
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if not is_batch_image(info):
+                continue
+            entry_name = f"{name}/{info.filename}"
+            if info.file_size > IMAGE_FETCH_MAX_BYTES:
+                yield entry_name, None, f"Image exceeds {IMAGE_FETCH_MAX_BYTES} bytes"
+                continue
+            yield entry_name, archive.read(info), None
+
+def read_batch_uploads(sources):
+    """Chain read_batch_images over (name, file) uploads, closing each file at the end."""
+    try:
+        for name, source in sources:
+            yield from read_batch_images(name, source)
+    finally:
+        for _, source in sources:
+            source.close()
+
+def batch_result(future, position, name):
+    try:
+        events = future.result()
+    except ValueError:
+        return {'index': position, 'name': name, 'status': 'error', 'error': 'Could not read the image.'}
+    except Exception as e:
+        logging.error(f"Batch image {name} failed: {e}")
+        return {'index': position, 'name': name, 'status': 'error', 'error': 'Processing failed.'}
+    return {'index': position, 'name': name, 'status': 'ok', 'events': events}
+
+def run_batch(submit, images, max_in_flight):
+    """Feed (name, image_bytes, error) entries to submit(image_bytes) -> Future,
+    keeping at most max_in_flight outstanding, and yield one result dict per image
+    in completion order."""
+    entries = enumerate(images)
+    futures = {}
+    exhausted = False
+    while True:
+        while not exhausted and len(futures) < max_in_flight:
+            entry = next(entries, None)
+            if entry is None:
+                exhausted = True
+                break
+            position, (name, data, error) = entry
+            if error:
+                yield {'index': position, 'name': name, 'status': 'error', 'error': error}
+                continue
+            futures[submit(data)] = (position, name)
+        if not futures:
+            return
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            position, name = futures.pop(future)
+            yield batch_result(future, position, name)
+
+def format_batch_results(results, output_format):
+    """Render run_batch results as NDJSON lines, or as one iCalendar stream of
+    every event (failed images are only logged)."""
+    if output_format == 'ics':
+        def batch_events():
+            for result in results:
+                if result['status'] == 'ok':
+                    yield from result['events']
+                else:
+                    logging.warning(f"Batch image {result['name']} skipped: {result['error']}")
+        yield from generate_ics(batch_events())
+        return
+    for result in results:
+        if result['status'] == 'ok':
+            result = dict(result, events=[event.as_dict() for event in result['events']])
+        yield json.dumps(result) + '\n'
+
+def submit_ocr_job(image_bytes):
+    now = time_module.monotonic()
+    with _ocr_jobs_lock:
+        for job_id, job in list(_ocr_jobs.items()):
+            if job['future'].done() and now - job['created'] > OCR_JOB_TTL:
+                del _ocr_jobs[job_id]
+        job_id = uuid.uuid4().hex
+        future = submit_ocr_task(image_bytes)
+        _ocr_jobs[job_id] = {'future': future, 'created': now}
+    logging.info(f"Queued OCR job {job_id}")
+    return job_id
+
+def get_ocr_job(job_id):
+    with _ocr_jobs_lock:
+        return _ocr_jobs.get(job_id)
+
+def discard_ocr_job(job_id):
+    with _ocr_jobs_lock:
+        _ocr_jobs.pop(job_id, None)
+
+def wants_json():
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json' and request.accept_mimetypes[best] > request.accept_mimetypes['text/html']
 
 @app.route('/authorize')
 def authorize():
+    from google_auth_oauthlib.flow import Flow
     state = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(16))
     session['state'] = state
     CLIENT_SECRETS_JSON = os.getenv('GOOGLE_CLIENT_SECRETS_JSON')
@@ -326,6 +1772,8 @@ def authorize():
 
 @app.route('/oauth2callback')
 def oauth2callback():
+    from google_auth_oauthlib.flow import Flow
+    from oauthlib.oauth2.rfc6749.errors import MissingCodeError
     state = session.get('state')
     flow = Flow.from_client_secrets_file(
         CLIENT_SECRETS_FILE,
@@ -361,31 +1809,28 @@ def credentials_to_dict(credentials):
 @app.route('/', methods=['GET', 'POST'])
 def upload_image():
     if request.method == 'POST':
-        image_path = None
+        image_bytes = None
         if 'image' in request.files and request.files['image'].filename != '':
             
-            file = request.files['image']
-            image_path = 'uploaded_image.png'
-            file.save(image_path)
+            image_bytes = request.files['image'].read()
         elif 'image_url' in request.form and request.form['image_url']:
             
             image_url = request.form['image_url']
             try:
-                response = requests.get(image_url)
-                img = Image.open(BytesIO(response.content))
-                image_path = 'uploaded_image_from_url.png'
-                img.save(image_path)
-            except Exception as e:
+                image_bytes = fetch_image(image_url)
+            except ImageFetchError as e:
+                logging.warning(f"Could not fetch image URL {image_url}: {e}")
                 flash('Invalid image URL.')
                 return redirect(request.url)
         elif 'paste_data' in request.form and request.form['paste_data']:
             
             paste_data = request.form['paste_data']
             if paste_data.startswith('data:image/'):
-                image_data = base64.b64decode(paste_data.split(',')[1])
-                image_path = 'pasted_image.png'
-                with open(image_path, 'wb') as f:
-                    f.write(image_data)
+                try:
+                    image_bytes = base64.b64decode(paste_data.split(',')[1])
+                except (IndexError, ValueError):
+                    flash('Invalid pasted image data.')
+                    return redirect(request.url)
             else:
                 flash('Invalid pasted image data.')
                 return redirect(request.url)
@@ -393,54 +1838,175 @@ def upload_image():
             flash('No image source provided.')
             return redirect(request.url)
         
-        if image_path:
+        if image_bytes and OCR_ASYNC:
+            try:
+                job_id = submit_ocr_job(image_bytes)
+            except OCRQueueFullError as e:
+                logging.warning(f"Rejecting upload: {e}")
+                if wants_json():
+                    response = jsonify({'error': 'Server busy, please retry.'})
+                else:
+                    flash('The server is busy processing other schedules. Please try again shortly.')
+                    response = make_response(render_template('upload.html'))
+                response.status_code = 503
+                response.headers['Retry-After'] = str(OCR_RETRY_AFTER)
+                return response
+            session['ocr_job'] = job_id
+            if wants_json():
+                return jsonify({'job_id': job_id, 'status_url': url_for('ocr_job_status', job_id=job_id)}), 202
+            return redirect(url_for('ocr_job_page', job_id=job_id))
+        if image_bytes:
             
-            schedule_text = extract_text_from_image(image_path)
-            events = parse_schedule(schedule_text)
+            try:
+                events = extract_events_from_image(image_bytes)
+            except ValueError:
+                flash('Could not read the image.')
+                return redirect(request.url)
             if not events:
                 flash('No events found in the image.')
                 return redirect(request.url)
             
-            session['events'] = events
+            store_session_events(events)
             return redirect(url_for('confirm_events'))  
+        flash('The image was empty.')
+        return redirect(request.url)
     return render_template('upload.html')
 
+@app.route('/jobs/<job_id>')
+def ocr_job_status(job_id):
+    job = get_ocr_job(job_id)
+    if job is None or session.get('ocr_job') != job_id:
+        return jsonify({'status': 'unknown'}), 404
+    future = job['future']
+    if not future.done():
+        return jsonify({'status': 'pending'})
+    discard_ocr_job(job_id)
+    session.pop('ocr_job', None)
+    try:
+        events = future.result()
+    except ValueError:
+        return jsonify({'status': 'failed', 'error': 'Could not read the image.'})
+    except Exception as e:
+        logging.error(f"OCR job {job_id} failed: {e}")
+        return jsonify({'status': 'failed', 'error': 'Processing failed.'})
+    if not events:
+        return jsonify({'status': 'failed', 'error': 'No events found in the image.'})
+    store_session_events(events)
+    return jsonify({'status': 'done', 'redirect': url_for('confirm_events')})
+
+@app.route('/batch', methods=['POST'])
+def batch_upload():
+    uploads = [upload for upload in request.files.getlist('images') if upload.filename]
+    count = sum(count_batch_images(upload.stream) for upload in uploads)
+    if count > BATCH_MAX_IMAGES:
+        return jsonify({'error': f"At most {BATCH_MAX_IMAGES} images per batch."}), 413
+    if not count:
+        return jsonify({'error': 'No images provided.'}), 400
+    # Read lazily: run_batch only pulls the next image when a slot frees up. Flask
+    # closes request files once the view returns, before the streamed body reads
+    # them, so the batch takes the file streams over and closes them itself.
+    sources = []
+    for upload in uploads:
+        sources.append((upload.filename, upload.stream))
+        upload.stream = BytesIO()
+    images = read_batch_uploads(sources)
+    output_format = request.args.get('format', 'ndjson')
+    submit = lambda data: submit_ocr_task(data, batch=True)
+    body = format_batch_results(run_batch(submit, images, BATCH_MAX_IN_FLIGHT), output_format)
+    if output_format == 'ics':
+        return Response(stream_with_context(body), mimetype='text/calendar',
+                        headers={'Content-Disposition': 'attachment; filename=schedules.ics'})
+    return Response(stream_with_context(body), mimetype='application/x-ndjson')
+
+@app.cli.command('batch')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--workers', default=OCR_POOL_SIZE, show_default=True, help='OCR worker processes.')
+@click.option('--format', 'output_format', type=click.Choice(['ndjson', 'ics']), default='ndjson', show_default=True,
+              help='One NDJSON result per image, or a single iCalendar file of every event.')
+def batch_command(paths, workers, output_format):
+    """OCR and parse schedule images, directories of images or zip archives,
+    printing results as each image finishes."""
+    def images():
+        for path in paths:
+            if os.path.isdir(path):
+                files = sorted(os.path.join(path, name) for name in os.listdir(path)
+                               if name.lower().endswith(BATCH_IMAGE_EXTENSIONS))
+            else:
+                files = [path]
+            for file_path in files:
+                with open(file_path, 'rb') as f:
+                    yield from read_batch_images(file_path, f)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_ocr_worker) as pool:
+        submit = lambda data: pool.submit(process_schedule_image, data)
+        # A couple of images per worker keeps every process busy without holding
+        # every decoded result in the pool's queues at once.
+        for chunk in format_batch_results(run_batch(submit, images(), workers * 2), output_format):
+            click.echo(chunk, nl=False)
+
+@app.route('/metrics')
+def metrics():
+    lines = [
+        '# HELP schedule_stage_duration_seconds Time spent in each request and pipeline stage.',
+        '# TYPE schedule_stage_duration_seconds histogram',
+    ]
+    with _stage_histograms_lock:
+        histograms = sorted(_stage_histograms.items())
+    for stage, histogram in histograms:
+        counts, count, total = histogram.snapshot()
+        for bound, bucket_count in zip(histogram.buckets, counts):
+            lines.append(f'schedule_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {bucket_count}')
+        lines.append(f'schedule_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+        lines.append(f'schedule_stage_duration_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'schedule_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+    cache_stats = ocr_cache.stats()
+    for name in ('hits', 'misses', 'disk_hits'):
+        lines.append(f'# TYPE schedule_ocr_cache_{name}_total counter')
+        lines.append(f'schedule_ocr_cache_{name}_total {cache_stats[name]}')
+    lines.append('# TYPE schedule_ocr_cache_entries gauge')
+    lines.append(f"schedule_ocr_cache_entries {cache_stats['entries']}")
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/jobs/<job_id>/wait')
+def ocr_job_page(job_id):
+    if session.get('ocr_job') != job_id:
+        flash('No schedule is being processed.')
+        return redirect(url_for('upload_image'))
+    return render_template('processing.html', status_url=url_for('ocr_job_status', job_id=job_id))
+
+def report_cpu_time(view):
+    """Log the CPU time a view used and expose it as a Server-Timing header."""
+    @wraps(view)
+    def timed_view(*args, **kwargs):
+        cpu_started = time_module.thread_time()
+        wall_started = time_module.perf_counter()
+        response = make_response(view(*args, **kwargs))
+        cpu_ms = (time_module.thread_time() - cpu_started) * 1000
+        wall_ms = (time_module.perf_counter() - wall_started) * 1000
+        logging.info(f"{view.__name__} {request.method}: {cpu_ms:.2f}ms CPU, {wall_ms:.2f}ms wall")
+        response.headers.add('Server-Timing', f'{view.__name__};desc="CPU";dur={cpu_ms:.2f}')
+        return response
+    return timed_view
+
 @app.route('/confirm', methods=['GET', 'POST'])
+@report_cpu_time
 def confirm_events():
     
-    if 'events' not in session:
+    events = load_session_events()
+    if events is None:
         flash('No events to confirm.')
         return redirect(url_for('upload_image'))
-    events = session['events']
-    
-    tz = pytz.timezone('America/Phoenix')
-    for event in events:
-        
-        if event.get('start_date_str') and event.get('start_time_str'):
-            start_str = f"{event['start_date_str']} {event['start_time_str']}"
-            naive_start = datetime.strptime(start_str, '%m/%d/%y %I:%M %p')
-            event['start'] = tz.localize(naive_start)
-        else:
-            event['start'] = None
-        
-        if event.get('start_date_str') and event.get('end_time_str'):
-            end_str = f"{event['start_date_str']} {event['end_time_str']}"
-            naive_end = datetime.strptime(end_str, '%m/%d/%y %I:%M %p')
-            event['end'] = tz.localize(naive_end)
-        else:
-            event['end'] = None
-        
-        if event.get('end_date_str'):
-            event['end_date'] = datetime.strptime(event['end_date_str'], '%m/%d/%y')
-        else:
-            event['end_date'] = None
     if request.method == 'POST':
         selected_event_ids = request.form.getlist('event')
-        selected_events = [event for event in events if event['id'] in selected_event_ids]
+        selected_events = [event for event in events if event.id in selected_event_ids]
         if not selected_events:
             flash('No events selected.')
             return redirect(url_for('upload_image'))
+        if request.form.get('action') == 'ics':
+            return Response(generate_ics(selected_events), mimetype='text/calendar',
+                            headers={'Content-Disposition': 'attachment; filename=schedule.ics'})
         
+        from google.oauth2.credentials import Credentials
+        from google.auth.transport.requests import Request
         credentials = session.get('credentials', None)
         if credentials:
             credentials = Credentials(**credentials)
@@ -450,20 +2016,23 @@ def confirm_events():
                 session['credentials'] = credentials_to_dict(credentials)
             else:
                 return redirect(url_for('authorize')) 
-        add_events_to_calendar(selected_events, credentials)
-        flash('Selected events added to your Google Calendar.')
-        session.pop('events', None)
+        if request.form.get('sync'):
+            results = sync_events_to_calendar(selected_events, credentials)
+            failed = [result for result in results if not result['success']]
+            counts = {action: sum(1 for result in results if result['action'] == action and result['success'])
+                      for action in ('insert', 'patch', 'delete', 'unchanged')}
+            flash(f"Calendar synced: {counts['insert']} added, {counts['patch']} updated, "
+                  f"{counts['delete']} removed, {counts['unchanged']} unchanged.")
+            if failed:
+                flash(f"Failed: {', '.join(result['summary'] for result in failed)}")
+        else:
+            results = add_events_to_calendar(selected_events, credentials)
+            failed = [result for result in results if not result['success']]
+            if failed:
+                flash(f"{len(results) - len(failed)} of {len(results)} events added. "
+                      f"Failed: {', '.join(result['summary'] for result in failed)}")
+            else:
+                flash('Selected events added to your Google Calendar.')
+        clear_session_events()
         return redirect(url_for('upload_image'))
-    
-    reverse_day_mapping = {
-        'MO': 'M',
-        'TU': 'Tu',
-        'WE': 'W',
-        'TH': 'Th',
-        'FR': 'F',
-        'SA': 'Sa',
-        'SU': 'Su'
-    }
-    for event in events:
-        event['days_str'] = ', '.join([reverse_day_mapping.get(d, d) for d in event['days_of_week']])
     return render_template('confirm.html', events=events)
\ No newline at end of file
@@ -1,9 +1,19 @@
-import requests
+import argparse
+import json
 import os
+import re
 import sys
-
+from concurrent.futures import ThreadPoolExecutor
+from importlib import metadata
 from pathlib import Path
 
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CACHE_DIR = Path.home() / '.cache' / 'package_sizes'
+REQUIREMENT_NAME_RE = re.compile(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)')
+EXTRA_MARKER_RE = re.compile(r'\bextra\s*==')
+
 def human_readable_size(size, decimal_places=2):
     for unit in ['B','KB','MB','GB','TB']:
         if size < 1024:
@@ -11,48 +21,134 @@ def human_readable_size(size, decimal_places=2):
         size /= 1024
     return f"{size:.{decimal_places}f} PB"
 
-def get_package_size(package_name):
+def normalize_name(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+def create_session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    return session
+
+def get_package_data(session, package_name, cache_dir=None):
+    """PyPI JSON metadata for a package, revalidated against an on-disk cache with ETags."""
     url = f"https://pypi.org/pypi/{package_name}/json"
+    cache_path = Path(cache_dir) / f"{normalize_name(package_name)}.json" if cache_dir else None
+    cached = None
+    if cache_path and cache_path.exists():
+        try:
+            cached = json.loads(cache_path.read_text())
+        except (OSError, ValueError):
+            cached = None
+    headers = {}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
     try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            # Get the latest version
-            version = data.get('info', {}).get('version')
-            if not version:
-                print(f"Could not find the latest version for package '{package_name}'.")
-                return None
-            releases = data.get('releases', {}).get(version, [])
-            if not releases:
-                print(f"No releases found for package '{package_name}' version '{version}'.")
-                return None
-            # Sum the sizes of all distribution files
-            total_size = 0
-            for file in releases:
-                file_size = file.get('size', 0)
-                total_size += file_size
-            return total_size
-        elif response.status_code == 404:
-            print(f"Package '{package_name}' not found on PyPI.")
-            return None
-        else:
-            print(f"Failed to fetch data for package '{package_name}'. Status code: {response.status_code}")
-            return None
+        response = session.get(url, headers=headers, timeout=10)
     except requests.RequestException as e:
+        if cached:
+            # Offline or PyPI unreachable: the cached copy is better than nothing.
+            return cached['data']
         print(f"Error fetching package '{package_name}': {e}")
         return None
+    if response.status_code == 304 and cached:
+        return cached['data']
+    if response.status_code == 200:
+        data = response.json()
+        if cache_path:
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                cache_path.write_text(json.dumps({'etag': response.headers.get('ETag'), 'data': data}))
+            except OSError as e:
+                print(f"Could not cache '{package_name}': {e}")
+        return data
+    elif response.status_code == 404:
+        print(f"Package '{package_name}' not found on PyPI.")
+        return None
+    else:
+        print(f"Failed to fetch data for package '{package_name}'. Status code: {response.status_code}")
+        return None
+
+def get_package_size(package_name, data):
+    # Get the latest version
+    version = data.get('info', {}).get('version')
+    if not version:
+        print(f"Could not find the latest version for package '{package_name}'.")
+        return None
+    releases = data.get('releases', {}).get(version, [])
+    if not releases:
+        print(f"No releases found for package '{package_name}' version '{version}'.")
+        return None
+    # Sum the sizes of all distribution files
+    total_size = 0
+    for file in releases:
+        file_size = file.get('size', 0)
+        total_size += file_size
+    return total_size
+
+def get_dependencies(data):
+    dependencies = []
+    for requirement in data.get('info', {}).get('requires_dist') or []:
+        # Optional extras are not installed by default; other markers are kept,
+        # so the tree errs on the side of overcounting.
+        requirement, _, marker = requirement.partition(';')
+        if EXTRA_MARKER_RE.search(marker):
+            continue
+        match = REQUIREMENT_NAME_RE.match(requirement)
+        if match:
+            dependencies.append(match.group(1))
+    return dependencies
+
+def get_installed_size(package_name):
+    """Bytes on disk for an installed distribution, from its RECORD; None if not installed."""
+    try:
+        distribution = metadata.distribution(package_name)
+    except metadata.PackageNotFoundError:
+        return None
+    total_size = 0
+    for file in distribution.files or []:
+        path = distribution.locate_file(file)
+        try:
+            total_size += os.path.getsize(path)
+        except OSError:
+            total_size += file.size or 0
+    return total_size
+
+def collect_packages(packages, session, workers, cache_dir, resolve_dependencies):
+    """Fetch PyPI data for the packages (and, optionally, their dependency tree)
+    concurrently, one tree level at a time. Returns {name: (data, required_by)}."""
+    results = {}
+    seen = {normalize_name(pkg) for pkg in packages}
+    level = [(pkg, None) for pkg in packages]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while level:
+            datas = executor.map(lambda item: get_package_data(session, item[0], cache_dir), level)
+            next_level = []
+            for (pkg, parent), data in zip(level, datas):
+                results[pkg] = (data, parent)
+                if not (resolve_dependencies and data):
+                    continue
+                for dependency in get_dependencies(data):
+                    if normalize_name(dependency) not in seen:
+                        seen.add(normalize_name(dependency))
+                        next_level.append((dependency, pkg))
+            level = next_level
+    return results
 
 def read_requirements(file_path):
     packages = []
     try:
-        with open(file_path, 'r') as f:
-            for line in f:
-                # Remove comments and whitespace
-                line = line.split('#')[0].strip()
-                if line:
-                    # Handle package specifications like package==version
-                    package = line.split('==')[0].strip()
-                    packages.append(package)
+        raw = Path(file_path).read_bytes()
+        # requirements.txt is sometimes saved as UTF-16 (e.g. by PowerShell redirection)
+        encoding = 'utf-16' if raw.startswith((b'\xff\xfe', b'\xfe\xff')) else 'utf-8-sig'
+        for line in raw.decode(encoding).splitlines():
+            # Remove comments and whitespace
+            line = line.split('#')[0].strip()
+            if line:
+                # Handle package specifications like package==version or package[extra]>=1.0
+                match = REQUIREMENT_NAME_RE.match(line)
+                if match:
+                    packages.append(match.group(1))
         return packages
     except FileNotFoundError:
         print(f"Requirements file '{file_path}' not found.")
@@ -61,32 +157,68 @@ def read_requirements(file_path):
         print(f"Error reading requirements file: {e}")
         sys.exit(1)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Report download and installed sizes of the packages in requirements.txt.')
+    parser.add_argument('requirements', nargs='?', default='requirements.txt', help='Requirements file to read.')
+    parser.add_argument('--deps', action='store_true', help='Also walk and size transitive dependencies.')
+    parser.add_argument('--installed', action='store_true', help='Add the on-disk size from the local site-packages.')
+    parser.add_argument('--offline', action='store_true', help='Skip PyPI; only report installed sizes.')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent PyPI requests.')
+    parser.add_argument('--cache-dir', default=str(DEFAULT_CACHE_DIR), help='Where PyPI responses are cached.')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the response cache.')
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     # Define the path to the requirements.txt
-    requirements_path = Path('requirements.txt')
+    requirements_path = Path(args.requirements)
     if not requirements_path.exists():
-        print("requirements.txt file not found in the current directory.")
+        print(f"{requirements_path} file not found.")
         sys.exit(1)
-    
+
     packages = read_requirements(requirements_path)
     if not packages:
         print("No packages found in requirements.txt.")
         sys.exit(0)
-    
-    print(f"{'Package':<30} {'Size':>10}")
-    print("-" * 42)
-    
+
+    show_installed = args.installed or args.offline
+    if args.offline:
+        results = {pkg: (None, None) for pkg in packages}
+    else:
+        session = create_session(args.workers)
+        cache_dir = None if args.no_cache else args.cache_dir
+        results = collect_packages(packages, session, args.workers, cache_dir, args.deps)
+
+    width = 42 + (14 if show_installed else 0) + (26 if args.deps else 0)
+    header = f"{'Package':<30} {'Size':>10}"
+    if show_installed:
+        header += f" {'Installed':>13}"
+    if args.deps:
+        header += f"  {'Required by':<24}"
+    print(header)
+    print("-" * width)
+
     total_size = 0
-    for pkg in packages:
-        size = get_package_size(pkg)
+    total_installed = 0
+    for pkg, (data, parent) in results.items():
+        size = get_package_size(pkg, data) if data else None
         if size is not None:
             total_size += size
-            print(f"{pkg:<30} {human_readable_size(size):>10}")
-        else:
-            print(f"{pkg:<30} {'N/A':>10}")
-    
-    print("-" * 42)
-    print(f"{'Total':<30} {human_readable_size(total_size):>10}")
+        row = f"{pkg:<30} {human_readable_size(size) if size is not None else 'N/A':>10}"
+        if show_installed:
+            installed = get_installed_size(pkg)
+            if installed is not None:
+                total_installed += installed
+            row += f" {human_readable_size(installed) if installed is not None else 'not installed':>13}"
+        if args.deps:
+            row += f"  {parent or '(requirements)':<24}"
+        print(row)
+
+    print("-" * width)
+    total = f"{'Total':<30} {human_readable_size(total_size):>10}"
+    if show_installed:
+        total += f" {human_readable_size(total_installed):>13}"
+    print(total)
 
 if __name__ == "__main__":
     main()
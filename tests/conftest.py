@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+# index.py refuses to import without these; the tests never touch OAuth.
+os.environ.setdefault('FLASK_SECRET_KEY', 'test')
+os.environ.setdefault('GOOGLE_CREDENTIALS_FILENAME', 'credentials.json')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import index
+
+
+def make_event(class_num='12345', summary='CSE 110 - Principles of Programming', **overrides):
+    values = dict(
+        summary=summary,
+        class_num=class_num,
+        units='3.0',
+        instructors='Smith, John',
+        days_str='M W',
+        time_str='9:00 AM - 9:50 AM',
+        date_str='08/22/24 - 12/06/24',
+        location='Tempe - CAVC351',
+        days_of_week=['MO', 'WE'],
+        start_time_str='9:00 AM',
+        end_time_str='9:50 AM',
+        start_date_str='08/22/24',
+        end_date_str='12/06/24',
+        id=class_num,
+    )
+    values.update(overrides)
+    return index.ScheduleEvent(**values)
+
+
+@pytest.fixture
+def event():
+    return make_event()
+
+
+def fake_extract_events(image_bytes):
+    if image_bytes == b'unreadable':
+        raise ValueError("Could not decode image data")
+    if image_bytes == b'slow':
+        time.sleep(0.5)
+    return [make_event(), make_event('23456', 'MAT 265 - Calculus for Engineers I', days_of_week=['TU', 'TH'])]
+
+
+@pytest.fixture
+def ocr_pool(monkeypatch):
+    """A real process pool whose workers return fixed events instead of running
+    OCR. The stand-in reaches the workers because they are forked after the patch."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    monkeypatch.setattr(index, 'extract_events_from_image', fake_extract_events)
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('fork')) as pool:
+        yield pool
@@ -0,0 +1,151 @@
+"""A local stand-in for the Google Calendar batch endpoint, built on http.server.
+
+It answers the multipart/mixed batch requests googleapiclient sends with one
+part per request, and events.list (GET) filtered by privateExtendedProperty.
+Statuses can be scripted per event summary, and an event can be stored even
+though its response reports a failure, as happens when a response is lost.
+The server can also stall, so client timeouts can be tested.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BOUNDARY = 'fake_calendar_batch'
+REASONS = {200: 'OK', 204: 'No Content', 404: 'Not Found', 409: 'Conflict',
+           429: 'Too Many Requests', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class FakeCalendar:
+    def __init__(self):
+        self.events = {}
+        # summary -> statuses to answer with, consumed one per attempt; 200 once exhausted.
+        self.statuses = {}
+        # summaries whose next insert is stored even though a failure status is returned.
+        self.store_anyway = set()
+        # seconds to stall before answering each batch, consumed one per batch.
+        self.batch_delays = []
+        self.batches = []
+        self.lists = []
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def root_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def answer(self, method, path, body):
+        """Apply one batched request; returns (status, response body)."""
+        match = re.match(r'/calendar/v3/calendars/[^/]+/events(?:/([^/?]+))?', path)
+        if not match:
+            return 404, {'error': {'code': 404, 'message': f'No route for {path}'}}
+        event_id = match.group(1)
+        summary = body.get('summary') if body else self.events.get(event_id, {}).get('summary')
+        with self.lock:
+            queued = self.statuses.get(summary) or []
+            status = queued.pop(0) if queued else 200
+            store = status < 300 or summary in self.store_anyway
+            self.store_anyway.discard(summary)
+            if method == 'POST':
+                event = dict(body, id=body.get('id') or uuid.uuid4().hex)
+                if event['id'] in self.events:
+                    return 409, {'error': {'code': 409, 'message': 'The requested identifier already exists.'}}
+                if store:
+                    self.events[event['id']] = event
+            elif event_id not in self.events:
+                return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+            elif method == 'DELETE':
+                if store:
+                    del self.events[event_id]
+                event = None
+            else:
+                event = dict(self.events[event_id], **body)
+                if store:
+                    self.events[event_id] = event
+        if status >= 300:
+            return status, {'error': {'code': status, 'message': REASONS.get(status, 'Error')}}
+        return (204, None) if event is None else (200, event)
+
+    def list_events(self, query):
+        """events.list: every stored event carrying all the requested private
+        properties, paged by maxResults/pageToken."""
+        self.lists.append(query)
+        wanted = [value.split('=', 1) for value in query.get('privateExtendedProperty', [])]
+        with self.lock:
+            matching = [event for event in self.events.values()
+                        if all(event.get('extendedProperties', {}).get('private', {}).get(key) == value
+                               for key, value in wanted)]
+        start = int(query.get('pageToken', ['0'])[0])
+        end = start + int(query.get('maxResults', ['250'])[0])
+        response = {'items': matching[start:end]}
+        if end < len(matching):
+            response['nextPageToken'] = str(end)
+        return response
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if not re.fullmatch(r'/calendar/v3/calendars/[^/]+/events', url.path):
+                    self.send_error(404)
+                    return
+                payload = json.dumps(fake.list_events(parse_qs(url.query))).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=UTF-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers['Content-Length']))
+                message = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + data)
+                with fake.lock:
+                    delay = fake.batch_delays.pop(0) if fake.batch_delays else 0
+                time.sleep(delay)
+                parts = []
+                requests = []
+                for part in message.iter_parts():
+                    head, payload = re.split(rb'\r?\n\r?\n', part.get_payload(decode=True), maxsplit=1)
+                    method, path, _ = head.splitlines()[0].decode().split(' ', 2)
+                    body = json.loads(payload) if payload.strip() else None
+                    requests.append((method, path, body))
+                    status, response = fake.answer(method, path, body)
+                    content = json.dumps(response) if response is not None else ''
+                    parts.append(
+                        f"--{BOUNDARY}\r\nContent-Type: application/http\r\n"
+                        f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+                        f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+                        f"Content-Type: application/json; charset=UTF-8\r\n"
+                        f"Content-Length: {len(content.encode())}\r\n\r\n{content}\r\n"
+                    )
+                with fake.lock:
+                    fake.batches.append(requests)
+                payload = (''.join(parts) + f"--{BOUNDARY}--\r\n").encode()
+                self.send_response(200)
+                self.send_header('Content-Type', f'multipart/mixed; boundary={BOUNDARY}')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
@@ -0,0 +1,179 @@
+import json
+import multiprocessing
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+
+import index
+
+
+def pool_submit(pool):
+    return lambda data: pool.submit(index.process_schedule_image, data)
+
+
+def test_batch_ndjson_through_process_pool(ocr_pool):
+    images = [('a.png', b'image', None), ('b.png', b'unreadable', None), ('c.png', None, 'Image too large')]
+    lines = list(index.format_batch_results(index.run_batch(pool_submit(ocr_pool), images, 2), 'ndjson'))
+    results = sorted((json.loads(line) for line in lines), key=lambda result: result['index'])
+    assert [result['status'] for result in results] == ['ok', 'error', 'error']
+    assert results[1]['error'] == 'Could not read the image.'
+    events = results[0]['events']
+    assert [event['class_num'] for event in events] == ['12345', '23456']
+    assert events[0]['rrule'] == 'RRULE:FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20241207T065959Z'
+    assert events[0]['start'] == '2024-08-22T09:00:00-07:00'
+
+
+def test_run_batch_keeps_at_most_max_in_flight():
+    lock = threading.Lock()
+    in_flight = 0
+    peak = 0
+
+    def task():
+        nonlocal in_flight
+        time.sleep(0.02)
+        with lock:
+            in_flight -= 1
+        return []
+
+    def submit(data):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        return executor.submit(task)
+
+    images = [(f"{n}.png", b'image', None) for n in range(6)]
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(index.run_batch(submit, images, 2))
+    assert sorted(result['index'] for result in results) == list(range(6))
+    assert peak == 2
+
+
+def test_batch_route_streams_ndjson(ocr_pool, monkeypatch):
+    monkeypatch.setattr(index, '_ocr_pool', ocr_pool)
+    client = index.app.test_client()
+    response = client.post('/batch', data={'images': [(BytesIO(b'image'), 'a.png'), (BytesIO(b'image'), 'b.png')]})
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [result['status'] for result in results] == ['ok', 'ok']
+
+
+def zip_of(*names):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name in names:
+            archive.writestr(name, b'image')
+    buffer.seek(0)
+    return buffer
+
+
+def test_run_batch_pulls_images_lazily():
+    pulled = []
+
+    def images():
+        for n in range(6):
+            pulled.append(n)
+            yield f"{n}.png", b'image', None
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = index.run_batch(lambda data: executor.submit(lambda: []), images(), 2)
+        next(results)
+        assert len(pulled) <= 3
+        assert len(list(results)) == 5
+
+
+def test_zip_entries_are_read_one_at_a_time(monkeypatch):
+    reads = []
+    read = zipfile.ZipFile.read
+    monkeypatch.setattr(zipfile.ZipFile, 'read', lambda self, info: reads.append(info) or read(self, info))
+    entries = index.read_batch_images('upload.zip', zip_of('a.png', 'notes.txt', 'b.png'))
+    assert next(entries) == ('upload.zip/a.png', b'image', None)
+    assert len(reads) == 1
+    assert [name for name, _, _ in entries] == ['upload.zip/b.png']
+
+
+def test_batch_uploads_are_closed_when_done():
+    sources = [('a.png', BytesIO(b'image')), ('b.zip', zip_of('b.png'))]
+    assert [name for name, _, _ in index.read_batch_uploads(sources)] == ['a.png', 'b.zip/b.png']
+    assert all(source.closed for _, source in sources)
+
+
+def test_batch_route_counts_zip_entries_without_reading_them(monkeypatch):
+    monkeypatch.setattr(index, 'BATCH_MAX_IMAGES', 2)
+    monkeypatch.setattr(zipfile.ZipFile, 'read', lambda *args: pytest.fail('entry was decompressed'))
+    response = index.app.test_client().post('/batch', data={'images': [(zip_of('a.png', 'b.png', 'c.png'), 'a.zip')]})
+    assert response.status_code == 413
+    assert 'At most 2' in response.get_json()['error']
+
+
+def test_batch_route_rejects_zip_without_images():
+    response = index.app.test_client().post('/batch', data={'images': [(zip_of('notes.txt'), 'a.zip')]})
+    assert response.status_code == 400
+
+
+def test_request_body_is_limited(monkeypatch):
+    monkeypatch.setitem(index.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    response = index.app.test_client().post('/batch', data={'images': [(BytesIO(b'\0' * 4096), 'a.png')]})
+    assert response.status_code == 413
+
+
+def test_batch_route_streams_zip_entries(ocr_pool, monkeypatch):
+    monkeypatch.setattr(index, '_ocr_pool', ocr_pool)
+    response = index.app.test_client().post('/batch', data={'images': [(zip_of('a.png', 'b.png'), 'a.zip')]})
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(result['name'] for result in results) == ['a.zip/a.png', 'a.zip/b.png']
+    assert all(result['status'] == 'ok' for result in results)
+
+
+def test_batch_leaves_queue_slots_for_uploads(ocr_pool, monkeypatch):
+    monkeypatch.setattr(index, '_ocr_pool', ocr_pool)
+    monkeypatch.setattr(index, '_ocr_queue_slots', threading.BoundedSemaphore(2))
+    monkeypatch.setattr(index, '_batch_slots', threading.BoundedSemaphore(1))
+    batch_future = index.submit_ocr_task(b'slow', batch=True)
+    # The batch may not take a second slot while its first image is running...
+    assert not index._batch_slots.acquire(blocking=False)
+    # ...so an upload still gets the remaining queue slot, and the next is refused.
+    job_id = index.submit_ocr_job(b'slow')
+    with pytest.raises(index.OCRQueueFullError):
+        index.submit_ocr_job(b'image')
+    batch_future.result()
+    index.get_ocr_job(job_id)['future'].result()
+    index.discard_ocr_job(job_id)
+    for slot in (index._ocr_queue_slots, index._batch_slots):
+        assert slot.acquire(blocking=False)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='the OCR stand-in only reaches forked workers')
+def test_batch_command(tmp_path, monkeypatch):
+    from conftest import fake_extract_events
+    monkeypatch.setattr(index, 'extract_events_from_image', fake_extract_events)
+    (tmp_path / 'a.png').write_bytes(b'image')
+    (tmp_path / 'b.png').write_bytes(b'unreadable')
+    result = index.app.test_cli_runner().invoke(args=['batch', '--workers', '2', str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    statuses = sorted(json.loads(line)['status'] for line in result.output.splitlines())
+    assert statuses == ['error', 'ok']
+
+
+def row_workers():
+    return index.OCR_ROW_WORKERS
+
+
+@pytest.mark.parametrize('configured, expected', [(None, 1), ('3', 3)])
+def test_pool_workers_run_row_ocr_on_one_thread(monkeypatch, configured, expected):
+    from concurrent.futures import ProcessPoolExecutor
+    if configured is None:
+        monkeypatch.delenv('OCR_ROW_WORKERS', raising=False)
+        # As on a four-core host, where the default is os.cpu_count().
+        monkeypatch.setattr(index, 'OCR_ROW_WORKERS', 4)
+    else:
+        monkeypatch.setenv('OCR_ROW_WORKERS', configured)
+        monkeypatch.setattr(index, 'OCR_ROW_WORKERS', int(configured))
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork'),
+                             initializer=index.init_ocr_worker) as pool:
+        assert pool.submit(row_workers).result() == expected
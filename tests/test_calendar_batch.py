@@ -0,0 +1,141 @@
+import httplib2
+import pytest
+from googleapiclient.discovery import build_from_document
+
+import index
+from conftest import make_event
+from fake_calendar import FakeCalendar
+
+
+@pytest.fixture
+def fake_calendar(monkeypatch):
+    monkeypatch.setattr(index, 'CALENDAR_RETRY_BASE_DELAY', 0)
+    fake = FakeCalendar().start()
+    yield fake
+    fake.stop()
+
+
+def calendar_service(fake, timeout=5):
+    document = dict(index.get_calendar_discovery_document(), rootUrl=fake.root_url)
+    return build_from_document(document, http=httplib2.Http(timeout=timeout))
+
+
+def sections(*summaries):
+    return [make_event(str(10000 + n), summary) for n, summary in enumerate(summaries)]
+
+
+def test_mixed_statuses_are_retried_per_request(fake_calendar):
+    fake_calendar.statuses = {'Throttled': [429, 429], 'Down': [503] * (index.CALENDAR_MAX_RETRIES + 1)}
+    events = sections('Fine', 'Throttled', 'Down')
+    results = index.add_events_to_calendar(events, None, service=calendar_service(fake_calendar))
+    assert [result['success'] for result in results] == [True, True, False]
+    assert '503' in results[2]['error']
+    assert sorted(event['summary'] for event in fake_calendar.events.values()) == ['Fine', 'Throttled']
+    # Only the failed requests go into the retry batches.
+    assert [len(batch) for batch in fake_calendar.batches] == [3, 2, 2, 1]
+
+
+def test_events_are_batched(fake_calendar, monkeypatch):
+    monkeypatch.setattr(index, 'CALENDAR_BATCH_SIZE', 2)
+    events = sections('A', 'B', 'C', 'D', 'E')
+    results = index.add_events_to_calendar(events, None, service=calendar_service(fake_calendar))
+    assert all(result['success'] for result in results)
+    assert [len(batch) for batch in fake_calendar.batches] == [2, 2, 1]
+
+
+def test_retried_insert_after_lost_response_is_not_duplicated(fake_calendar):
+    fake_calendar.statuses = {'Lost': [503]}
+    fake_calendar.store_anyway = {'Lost'}
+    results = index.add_events_to_calendar(sections('Lost'), None, service=calendar_service(fake_calendar))
+    assert results[0]['success']
+    assert [event['summary'] for event in fake_calendar.events.values()] == ['Lost']
+
+
+def test_timed_out_batch_is_retried(fake_calendar, monkeypatch):
+    monkeypatch.setattr(index, 'CALENDAR_BATCH_SIZE', 1)
+    # The second batch stalls past the client timeout but is still applied.
+    fake_calendar.batch_delays = [0, 1.5]
+    results = index.add_events_to_calendar(sections('First', 'Second'), None,
+                                           service=calendar_service(fake_calendar, timeout=0.5))
+    assert [result['success'] for result in results] == [True, True]
+    assert sorted(event['summary'] for event in fake_calendar.events.values()) == ['First', 'Second']
+
+
+def test_transport_failure_is_reported_per_event(fake_calendar, monkeypatch):
+    monkeypatch.setattr(index, 'CALENDAR_BATCH_SIZE', 1)
+    fake_calendar.batch_delays = [0] + [1] * (index.CALENDAR_MAX_RETRIES + 1)
+    results = index.add_events_to_calendar(sections('First', 'Second'), None,
+                                           service=calendar_service(fake_calendar, timeout=0.3))
+    assert results[0]['success']
+    assert not results[1]['success']
+    assert 'timed out' in results[1]['error']
+
+
+def sync(fake, events):
+    return index.sync_events_to_calendar(events, None, service=calendar_service(fake))
+
+
+def actions(results):
+    return sorted((result['action'], result['summary']) for result in results if result['success'])
+
+
+def test_first_sync_only_inserts(fake_calendar):
+    results = sync(fake_calendar, sections('A', 'B'))
+    assert actions(results) == [('insert', 'A'), ('insert', 'B')]
+    assert all(result['success'] for result in results)
+    assert sorted(event['summary'] for event in fake_calendar.events.values()) == ['A', 'B']
+    assert fake_calendar.lists[0]['privateExtendedProperty'] == [f"{index.TERM_PROPERTY}=20240822-20241206"]
+
+
+def test_changed_resync_patches_inserts_and_deletes(fake_calendar):
+    kept, dropped = sections('Kept', 'Dropped')
+    sync(fake_calendar, [kept, dropped])
+    moved = make_event(kept.class_num, 'Kept', location='Tempe - PSH 150')
+    added = make_event('20000', 'Added')
+    fake_calendar.batches.clear()
+    results = sync(fake_calendar, [moved, added])
+    assert actions(results) == [('delete', 'Dropped'), ('insert', 'Added'), ('patch', 'Kept')]
+    assert [len(batch) for batch in fake_calendar.batches] == [3]
+    stored = {event['summary']: event for event in fake_calendar.events.values()}
+    assert sorted(stored) == ['Added', 'Kept']
+    assert stored['Kept']['location'] == 'Tempe - PSH 150'
+
+
+def test_unchanged_resync_writes_nothing(fake_calendar):
+    events = sections('A', 'B')
+    sync(fake_calendar, events)
+    fake_calendar.batches.clear()
+    results = sync(fake_calendar, events)
+    assert actions(results) == [('unchanged', 'A'), ('unchanged', 'B')]
+    assert fake_calendar.batches == []
+
+
+def test_extra_copies_of_a_class_are_deleted(fake_calendar):
+    event, = sections('A')
+    sync(fake_calendar, [event])
+    # An earlier non-sync add left a second copy of the same class.
+    index.add_events_to_calendar([event], None, service=calendar_service(fake_calendar))
+    results = sync(fake_calendar, [event])
+    assert actions(results) == [('delete', 'A'), ('unchanged', 'A')]
+    assert len(fake_calendar.events) == 1
+
+
+def test_delete_of_missing_event_counts_as_success(fake_calendar):
+    sync(fake_calendar, sections('Gone'))
+    fake_calendar.statuses = {'Gone': [404]}
+    results = sync(fake_calendar, [make_event('20000', 'Other')])
+    gone = next(result for result in results if result['action'] == 'delete')
+    assert gone['summary'] == 'Gone'
+    assert gone['success'] and gone['error'] is None
+    assert all(result['success'] for result in results)
+
+
+@pytest.mark.parametrize('write', [index.add_events_to_calendar, index.sync_events_to_calendar])
+def test_calendar_writes_are_timed_once(fake_calendar, monkeypatch, write):
+    monkeypatch.setattr(index, 'build_calendar_service', lambda credentials: calendar_service(fake_calendar))
+    monkeypatch.setattr(index, 'calendar_service_key', lambda credentials: 'test')
+    monkeypatch.setattr(index, '_calendar_services', index.OrderedDict())
+    monkeypatch.setattr(index, '_stage_histograms', {})
+    write(sections('A'), None)
+    assert index._stage_histograms[write.__name__].count == 1
+    assert len(fake_calendar.events) == 1
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+
+import index
+
+
+def credentials(token='token'):
+    return SimpleNamespace(client_id='client', refresh_token='refresh', token=token)
+
+
+@pytest.fixture
+def built(monkeypatch):
+    services = []
+
+    def build(credentials):
+        services.append(object())
+        return services[-1]
+
+    monkeypatch.setattr(index, 'build_calendar_service', build)
+    monkeypatch.setattr(index, '_calendar_services', index.OrderedDict())
+    return services
+
+
+def test_service_is_reused_between_requests(built):
+    with index.calendar_service(credentials()) as first:
+        pass
+    with index.calendar_service(credentials()) as second:
+        pass
+    assert first is second
+    assert len(built) == 1
+
+
+def test_concurrent_requests_never_share_a_service(built):
+    with index.calendar_service(credentials()) as first:
+        with index.calendar_service(credentials()) as second:
+            assert first is not second
+    # Both are returned and reused afterwards rather than rebuilt.
+    with index.calendar_service(credentials()) as third:
+        with index.calendar_service(credentials()) as fourth:
+            assert {third, fourth} == {first, second}
+    assert len(built) == 2
+
+
+def test_service_is_returned_when_the_request_fails(built):
+    with pytest.raises(RuntimeError):
+        with index.calendar_service(credentials()) as first:
+            raise RuntimeError
+    with index.calendar_service(credentials()) as second:
+        assert second is first
+
+
+def test_least_recently_used_credentials_are_evicted(built, monkeypatch):
+    monkeypatch.setattr(index, 'CALENDAR_SERVICE_CACHE_SIZE', 2)
+    for token in ('a', 'b', 'a', 'c'):
+        with index.calendar_service(credentials(token)):
+            pass
+    assert len(index._calendar_services) == 2
+    with index.calendar_service(credentials('b')):
+        pass
+    assert len(built) == 4
+
+
+def test_each_service_has_its_own_http():
+    from google.oauth2.credentials import Credentials
+    first = index.build_calendar_service(Credentials(token='token'))
+    second = index.build_calendar_service(Credentials(token='token'))
+    assert first._http is not second._http
+    assert first._http.http.timeout == index.CALENDAR_HTTP_TIMEOUT
@@ -0,0 +1,135 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import index
+
+LIMIT = 64 * 1024
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 1024
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self, content_type='image/png', length=None, chunked=False):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if length is not None:
+            self.send_header('Content-Length', str(length))
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def do_GET(self):
+        try:
+            self.route()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def route(self):
+        if self.path == '/image.png':
+            self.send_head(length=len(PNG))
+            self.wfile.write(PNG)
+        elif self.path == '/page.html':
+            body = b'<html></html>'
+            self.send_head('text/html', length=len(body))
+            self.wfile.write(body)
+        elif self.path == '/missing.png':
+            self.send_error(404)
+        elif self.path == '/declared-huge.png':
+            self.send_head(length=LIMIT * 10)
+            self.wfile.write(PNG)
+        elif self.path in ('/chunked-huge.png', '/lying-chunked-huge.png'):
+            # The second variant also claims a small Content-Length, which chunked encoding overrides.
+            self.send_head(length=len(PNG) if self.path.startswith('/lying') else None, chunked=True)
+            for _ in range(LIMIT * 2 // 4096):
+                self.write_chunk(b'\0' * 4096)
+            self.wfile.write(b'0\r\n\r\n')
+        elif self.path == '/unsized-huge.png':
+            self.send_head()
+            self.wfile.write(b'\0' * LIMIT * 2)
+        elif self.path == '/truncated.png':
+            self.send_head(length=len(PNG) * 2)
+            self.wfile.write(PNG)
+        elif self.path == '/slow-chunked.png':
+            self.send_head(chunked=True)
+            for _ in range(40):
+                self.write_chunk(b'\0' * 16)
+                time.sleep(0.05)
+            self.wfile.write(b'0\r\n\r\n')
+        elif self.path == '/slow.png':
+            self.send_head(length=16 * 40)
+            for _ in range(40):
+                self.wfile.write(b'\0' * 16)
+                self.wfile.flush()
+                time.sleep(0.05)
+        else:
+            self.send_error(404)
+
+
+@pytest.fixture
+def image_server(monkeypatch):
+    monkeypatch.setattr(index, 'IMAGE_FETCH_MAX_BYTES', LIMIT)
+    monkeypatch.setattr(index, 'IMAGE_FETCH_DEADLINE', 0.5)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    yield f"http://{host}:{port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetches_image(image_server):
+    assert bytes(index.fetch_image(f"{image_server}/image.png")) == PNG
+
+
+@pytest.mark.parametrize('url', ['file:///etc/passwd', 'ftp://example.com/image.png', 'gopher://example.com/'])
+def test_rejects_non_http_schemes(url):
+    with pytest.raises(index.ImageFetchError, match='Only http and https'):
+        index.fetch_image(url)
+
+
+def test_rejects_non_image_content_type(image_server):
+    with pytest.raises(index.ImageFetchError, match='Not an image'):
+        index.fetch_image(f"{image_server}/page.html")
+
+
+def test_reports_http_errors(image_server):
+    with pytest.raises(index.ImageFetchError, match='404'):
+        index.fetch_image(f"{image_server}/missing.png")
+
+
+def test_reports_truncated_body(image_server):
+    with pytest.raises(index.ImageFetchError):
+        index.fetch_image(f"{image_server}/truncated.png")
+
+
+def test_rejects_declared_length_over_limit(image_server):
+    with pytest.raises(index.ImageFetchError, match='limit is'):
+        index.fetch_image(f"{image_server}/declared-huge.png")
+
+
+@pytest.mark.parametrize('path', ['/chunked-huge.png', '/lying-chunked-huge.png', '/unsized-huge.png'])
+def test_enforces_limit_while_reading(image_server, path):
+    with pytest.raises(index.ImageFetchError, match='exceeds'):
+        index.fetch_image(f"{image_server}{path}")
+
+
+@pytest.mark.parametrize('path', ['/slow-chunked.png', '/slow.png'])
+def test_slow_body_trips_deadline(image_server, path):
+    started = time.monotonic()
+    with pytest.raises(index.ImageFetchError, match='longer than'):
+        index.fetch_image(f"{image_server}{path}")
+    assert time.monotonic() - started < 1.5
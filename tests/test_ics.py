@@ -0,0 +1,48 @@
+from io import BytesIO
+
+import index
+from conftest import make_event
+
+
+def unfold(document):
+    return document.replace('\r\n ', '').split('\r\n')
+
+
+def test_fold_ics_line_limits_octets():
+    line = 'SUMMARY:' + 'é' * 100
+    folded = index.fold_ics_line(line)
+    physical = folded.split('\r\n')[:-1]
+    assert all(len(part.encode('utf-8')) <= 75 for part in physical)
+    assert folded.replace('\r\n ', '') == line + '\r\n'
+
+
+def test_escape_ics_text():
+    assert index.escape_ics_text('A, B; C\\D\nE') == 'A\\, B\\; C\\\\D\\nE'
+
+
+def test_generate_ics_event(event):
+    lines = unfold(''.join(index.generate_ics([event])))
+    assert lines[0] == 'BEGIN:VCALENDAR'
+    assert lines[-2] == 'END:VCALENDAR'
+    assert 'DTSTART;TZID=America/Phoenix:20240822T090000' in lines
+    assert 'DTEND;TZID=America/Phoenix:20240822T095000' in lines
+    assert 'SUMMARY:CSE 110 - Principles of Programming' in lines
+    assert event.rrule in lines
+
+
+def test_ics_from_pool_batch(ocr_pool):
+    submit = lambda data: ocr_pool.submit(index.process_schedule_image, data)
+    images = [('a.png', b'image', None), ('b.png', b'unreadable', None)]
+    document = ''.join(index.format_batch_results(index.run_batch(submit, images, 2), 'ics'))
+    lines = unfold(document)
+    assert lines.count('BEGIN:VEVENT') == 2
+    assert 'RRULE:FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20241207T065959Z' in lines
+    assert 'RRULE:FREQ=WEEKLY;BYDAY=TU,TH;UNTIL=20241207T065959Z' in lines
+
+
+def test_batch_route_ics(ocr_pool, monkeypatch):
+    monkeypatch.setattr(index, '_ocr_pool', ocr_pool)
+    response = index.app.test_client().post('/batch?format=ics', data={'images': [(BytesIO(b'image'), 'a.png')]})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/calendar'
+    assert unfold(response.get_data(as_text=True)).count('BEGIN:VEVENT') == 2
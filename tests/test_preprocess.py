@@ -0,0 +1,124 @@
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytest
+
+import index
+
+
+def schedule_png(rows=8):
+    """A light-grey ruled table of text rows under a dark banner, like the class schedule page."""
+    width, row_height = 1800, 40
+    image = np.full((120 + row_height * (rows + 1), width, 3), 255, np.uint8)
+    image[:60] = (64, 29, 140)
+    for row in range(rows + 1):
+        y = 100 + row * row_height
+        cv2.putText(image, f"{12345 + row} CSE 110 Principles of Programming 3.00 MW 9:00 AM - 9:50 AM",
+                    (50, y + 28), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (30, 30, 30), 2)
+        cv2.line(image, (40, y + row_height), (width - 40, y + row_height), (221, 221, 221), 1)
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def test_preprocessing_is_repeatable():
+    image = schedule_png()
+    first = index.preprocess_image(image).copy()
+    second = index.preprocess_image(image)
+    assert first.shape == second.shape
+    assert (first == second).all()
+
+
+def test_steady_state_allocates_little_beyond_the_decoded_image():
+    image = schedule_png()
+    decoded_bytes = index.decode_image(image).nbytes
+    index.preprocess_image(image)
+    tracemalloc.start()
+    try:
+        index.preprocess_image(image)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < decoded_bytes + 256 * 1024
+
+
+def test_buffers_are_reused():
+    engine = index.PreprocessEngine()
+    first = engine.buffer('gray', (100, 200))
+    second = engine.buffer('gray', (50, 80))
+    assert np.shares_memory(first, second)
+    assert second.shape == (50, 80) and second.flags['C_CONTIGUOUS']
+    assert not np.shares_memory(first, engine.buffer('gray', (200, 200)))
+
+
+def test_resize_writes_into_buffer_and_matches_cv2():
+    engine = index.PreprocessEngine()
+    gray = np.random.default_rng(0).integers(0, 255, (333, 517), dtype=np.uint8)
+    for scale, interpolation in ((1.97, cv2.INTER_CUBIC), (0.43, cv2.INTER_AREA)):
+        resized = engine.resize(gray, scale, interpolation)
+        expected = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation)
+        assert np.shares_memory(resized, engine.buffer('resized', resized.shape))
+        assert (resized == expected).all()
+
+
+@pytest.mark.parametrize('method, size', [('open', 2), ('median', 3)])
+def test_denoise_removes_specks(monkeypatch, method, size):
+    monkeypatch.setattr(index, 'OCR_DENOISE_METHOD', method)
+    monkeypatch.setattr(index, 'OCR_DENOISE_SIZE', size)
+    thresh = np.zeros((40, 40), np.uint8)
+    thresh[10:30, 10:30] = 255
+    thresh[2, 2] = 255
+    denoised = index.PreprocessEngine().denoise(thresh)
+    assert denoised[2, 2] == 0
+    assert denoised[20, 20] == 255
+
+
+def test_no_denoise_returns_threshold(monkeypatch):
+    monkeypatch.setattr(index, 'OCR_DENOISE_METHOD', 'none')
+    thresh = np.zeros((4, 4), np.uint8)
+    assert index.PreprocessEngine().denoise(thresh) is thresh
+
+
+def test_table_region_skips_the_banner():
+    gray = cv2.cvtColor(index.decode_image(schedule_png()), cv2.COLOR_BGR2GRAY)
+    thresh = index.PreprocessEngine().binarize(gray, 'fixed')
+    x, y, w, h = index.find_table_region(gray, thresh)
+    assert y >= 60
+    assert y + h >= gray.shape[0] - index.ROI_PADDING - 40
+    assert w < gray.shape[1]
+
+
+def test_text_block_region_skips_solid_bars():
+    thresh = np.zeros((400, 1000), np.uint8)
+    thresh[:80] = 255
+    for row in range(150, 350, 40):
+        thresh[row:row + 14, 100:900:6] = 255
+    x, y, w, h = index.find_text_block_region(thresh)
+    assert y >= 100 and h < 300
+
+
+def text_image(height):
+    """Rows of square 'glyphs' `height` pixels tall on white."""
+    gray = np.full((height * 40, 1200), 255, np.uint8)
+    for row in range(2, 38, 3):
+        for col in range(20, 1100, height * 2):
+            gray[row * height:(row + 1) * height, col:col + height] = 0
+    return gray
+
+
+def test_normalization_does_not_enlarge_small_text_by_default():
+    gray = text_image(10)
+    resized, scale, text_height = index.normalize_resolution(gray)
+    assert text_height and text_height < index.OCR_TARGET_TEXT_HEIGHT
+    assert scale == 1.0 and resized is gray
+
+
+def test_normalization_shrinks_large_text():
+    resized, scale, _ = index.normalize_resolution(text_image(56))
+    assert scale < 1.0
+    assert resized.shape[1] < 1200
+
+
+def test_upscaling_is_opt_in(monkeypatch):
+    monkeypatch.setattr(index, 'OCR_MAX_SCALE', 2.0)
+    _, scale, _ = index.normalize_resolution(text_image(10))
+    assert scale > 1.0
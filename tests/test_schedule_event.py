@@ -0,0 +1,36 @@
+import pickle
+
+import index
+from conftest import make_event
+
+
+def test_unset_sentinel_survives_pickle():
+    assert pickle.loads(pickle.dumps(index._UNSET)) is index._UNSET
+
+
+def test_uncomputed_event_survives_pickle(event):
+    restored = pickle.loads(pickle.dumps(event))
+    assert restored._rrule is index._UNSET
+    assert restored.rrule == 'RRULE:FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20241207T065959Z'
+    assert restored.start.isoformat() == '2024-08-22T09:00:00-07:00'
+
+
+def test_cached_values_survive_pickle(event):
+    event.is_schedulable()
+    restored = pickle.loads(pickle.dumps(event))
+    assert restored.start == event.start
+    assert restored.end == event.end
+    assert restored.rrule == event.rrule
+
+
+def test_session_round_trip(event):
+    restored = index.ScheduleEvent.from_session(event.to_session())
+    assert restored == event
+    assert restored.start == event.start
+    assert restored.rrule == event.rrule
+
+
+def test_event_without_dates_has_no_rrule():
+    event = make_event(days_of_week=[], start_date_str=None, end_date_str=None)
+    assert event.rrule is None
+    assert not event.is_schedulable()
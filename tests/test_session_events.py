@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import index
+
+
+def test_pool_events_serialize_for_the_session(ocr_pool):
+    events = ocr_pool.submit(index.process_schedule_image, b'image').result()
+    json.dumps([event.to_session() for event in events])
+
+
+def test_store_and_load_pool_events(ocr_pool):
+    events = ocr_pool.submit(index.process_schedule_image, b'image').result()
+    with index.app.test_request_context():
+        index.store_session_events(events)
+        loaded = index.load_session_events()
+        assert loaded == events
+        assert [event.rrule for event in loaded] == [event.rrule for event in events]
+        assert [event.start for event in loaded] == [event.start for event in events]
+        index.clear_session_events()
+        assert index.load_session_events() is None
+
+
+def session_cookie(app):
+    from flask import session
+    return app.session_interface.get_signing_serializer(app).dumps(dict(session))
+
+
+def test_cookie_store_works_on_another_instance(monkeypatch, event):
+    monkeypatch.setattr(index, 'session_store', index.CookieSessionStore())
+    with index.app.test_request_context():
+        index.store_session_events([event])
+        cookie = session_cookie(index.app)
+    # A fresh store stands in for a different serverless instance.
+    monkeypatch.setattr(index, 'session_store', index.CookieSessionStore())
+    cookie_name = index.app.config['SESSION_COOKIE_NAME']
+    with index.app.test_request_context(headers={'Cookie': f"{cookie_name}={cookie}"}):
+        assert index.load_session_events() == [event]
+        index.clear_session_events()
+        assert index.load_session_events() is None
+
+
+@pytest.mark.parametrize('store', ['memory', 'sqlite'])
+def test_server_side_stores(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(index, 'SESSION_STORE', store)
+    monkeypatch.setattr(index, 'SESSION_STORE_PATH', str(tmp_path / 'sessions.sqlite3'))
+    session_store = index.create_session_store()
+    session_store.put('key', b'payload')
+    assert session_store.get('key') == b'payload'
+    assert session_store.get('other') is None
+    session_store.delete('key')
+    assert session_store.get('key') is None
+
+
+def test_server_side_store_expires(tmp_path):
+    session_store = index.SQLiteSessionStore(str(tmp_path / 'sessions.sqlite3'), ttl=-1)
+    session_store.put('key', b'payload')
+    assert session_store.get('key') is None
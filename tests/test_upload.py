@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+from io import BytesIO
+
+import pytest
+
+import index
+from conftest import fake_extract_events
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def upload(client, **form):
+    return client.post('/', data=dict(form, image=(BytesIO(b'image'), 'schedule.png')),
+                       headers={'Accept': 'application/json'})
+
+
+def test_client_cannot_switch_on_async_mode(monkeypatch):
+    monkeypatch.setattr(index, 'OCR_ASYNC', False)
+    monkeypatch.setattr(index, 'extract_events_from_image', fake_extract_events)
+    monkeypatch.setattr(index, 'submit_ocr_job', lambda image_bytes: pytest.fail('upload was queued'))
+    response = upload(index.app.test_client(), mode='async')
+    assert response.status_code == 302
+    assert response.location.endswith('/confirm')
+
+
+def test_async_mode_when_enabled(ocr_pool, monkeypatch):
+    monkeypatch.setattr(index, 'OCR_ASYNC', True)
+    monkeypatch.setattr(index, '_ocr_pool', ocr_pool)
+    client = index.app.test_client()
+    response = upload(client)
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    index.get_ocr_job(job_id)['future'].result()
+    assert client.get(f"/jobs/{job_id}").get_json()['status'] == 'done'
+
+
+@pytest.mark.parametrize('setting', ['OCR_ASYNC=1', 'SESSION_STORE=memory'])
+def test_instance_local_state_is_refused_on_vercel(setting):
+    name, value = setting.split('=')
+    env = dict(os.environ, VERCEL='1', **{name: value})
+    result = subprocess.run([sys.executable, '-c', 'import index'], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'Vercel' in result.stderr